@@ -123,8 +123,9 @@ OPTIONS = {
                 "option_name": "thread_type",
                 "type": TYPE_CHOICE,
                 "choices": ("ctypes",
+                            "cooperative",
                             "traced"),
-                "description": "Which type of threads to use. 'ctypes' is faster and should be preferred",
+                "description": "Which type of threads to use. 'ctypes' and 'cooperative' are faster and should be preferred",
             },
         ],
     "display":
@@ -10,7 +10,8 @@ import threading
 
 def main(args):
     ap = argparse.ArgumentParser()
-    ap.parse_args(args)
+    ap.add_argument('-l', '--long', action='store_true', help='also show the resource usage of each job')
+    ns = ap.parse_args(args)
 
     current_worker = threading.currentThread()
 
@@ -19,7 +20,10 @@ def main(args):
 
     for worker in _stash.get_workers():
         if worker.job_id != current_worker.job_id:
-            print(worker)
+            if ns.long:
+                print('{}  {!r}'.format(worker, worker.stats))
+            else:
+                print(worker)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Run a command and print its resource usage to stderr.
+"""
+from __future__ import print_function
+import sys
+import argparse
+
+from six.moves import shlex_quote
+
+from stash.system.shthreads import format_seconds
+
+
+def main(args):
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-v', '--verbose', action='store_true', help='also show the io of the command')
+    ap.add_argument('command', help='command to run')
+    ap.add_argument('args', nargs=argparse.REMAINDER, help='arguments of the command')
+    ns = ap.parse_args(args)
+
+    _stash = globals()['_stash']
+    """:type : StaSh"""
+
+    _, current_state = _stash.runtime.get_current_worker_and_state()
+    cmdline = ' '.join(shlex_quote(arg) for arg in [ns.command] + ns.args)
+    worker = _stash(
+        cmdline,
+        final_ins=current_state.sys_stdin,
+        final_outs=current_state.sys_stdout,
+        final_errs=current_state.sys_stderr,
+        add_to_history=False
+    )
+
+    stats = worker.stats
+    sys.stderr.write('\n')
+    sys.stderr.write('real\t{}\n'.format(format_seconds(stats.wall_time)))
+    sys.stderr.write('user\t{}\n'.format(format_seconds(stats.user_time)))
+    sys.stderr.write('sys\t{}\n'.format(format_seconds(stats.sys_time)))
+    if ns.verbose:
+        sys.stderr.write('stdout\t{}\n'.format(stats.stdout_size))
+        sys.stderr.write('stderr\t{}\n'.format(stats.stderr_size))
+        sys.stderr.write('stdin\t{} lines\n'.format(stats.stdin_lines))
+        sys.stderr.write('pipe\t{}\n'.format(stats.peak_pipe_size))
+
+    sys.exit(worker.state.return_value)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -13,6 +13,9 @@ import logging.handlers
 import os
 import platform
 import sys
+import threading
+import time
+from collections import OrderedDict
 from io import IOBase
 
 import six
@@ -31,6 +34,7 @@ from .system.shparsers import ShCompleter, ShExpander, ShParser
 from .system.shruntime import ShRuntime
 from .system.shscreens import ShSequentialScreen
 from .system.shstreams import ShMiniBuffer, ShStream
+from .system.shthreads import check_cancelled
 from .system.shui import get_ui_implementation
 from .system.shuseractionproxy import ShUserActionProxy
 
@@ -58,6 +62,7 @@ py_traceback=0
 py_pdb=0
 input_encoding_utf8=1
 thread_type=ctypes
+parser_engine=native
 
 [display]
 TEXT_FONT_SIZE={font_size}
@@ -105,12 +110,21 @@ class StaSh(object):
     def __init__(self, debug=(), log_setting=None, no_cfgfile=False, no_rcfile=False, no_historyfile=False, command=None):
         self.__version__ = __version__
 
+        # Startup profiling, see get_startup_report()
+        self.startup_times = OrderedDict()
+        self._startup_t0 = self._startup_last = time.time()
+
+        # Shared libraries are loaded on first attribute access
+        self._lib_files = {}
+        self._lib_lock = threading.RLock()
+
         # Intercept IO
         enable_io_wrapper()
 
         self.config = self._load_config(no_cfgfile=no_cfgfile)
         self.logger = self._config_logging(log_setting)
         self.enable_styles = self.config.getboolean("style", "enable_styles")
+        self._record_startup_phase('config')
 
         self.user_action_proxy = ShUserActionProxy(self)
 
@@ -135,16 +149,21 @@ class StaSh(object):
         self.terminal = None  # will be set during UI initialisation
         self.ui = ShUI(self, debug=(_DEBUG_UI in debug), debug_terminal=(_DEBUG_TERMINAL in debug))
         self.renderer = ShSequentialRenderer(self, self.main_screen, self.terminal, debug=_DEBUG_RENDERER in debug)
+        self._record_startup_phase('ui')
 
-        parser = ShParser(debug=_DEBUG_PARSER in debug)
+        # The pyparsing grammar is only built on first parse if selected
+        parser = ShParser(debug=_DEBUG_PARSER in debug, engine=self.config.get('system', 'parser_engine'))
         expander = ShExpander(self, debug=_DEBUG_EXPANDER in debug)
+        # The history file is loaded in the background
         self.runtime = ShRuntime(self, parser, expander, no_historyfile=no_historyfile, debug=_DEBUG_RUNTIME in debug)
         self.completer = ShCompleter(self, debug=_DEBUG_COMPLETER in debug)
+        self._record_startup_phase('runtime')
 
         # Navigate to the startup folder
         if IN_PYTHONISTA:
             os.chdir(self.runtime.state.environ_get('HOME2'))
         self.runtime.load_rcfile(no_rcfile=no_rcfile)
+        self._record_startup_phase('rcfile')
         self.io.write(
             self.text_style(
                 'StaSh v%s on python %s\n' % (
@@ -177,8 +196,9 @@ class StaSh(object):
                     always=True,
                 ),
             )
-        # Load shared libraries
+        # Find shared libraries (they are loaded on first access)
         self._load_lib()
+        self._record_startup_phase('lib')
 
         # run command (this calls script_will_end)
         if command is None:
@@ -189,12 +209,29 @@ class StaSh(object):
             if self.runtime.debug:
                 self.logger.debug("Running command: {!r}".format(command))
             self(command, add_to_history=False, persistent_level=0)
+        self._record_startup_phase('command')
+
+    def __getattr__(self, name):
+        """
+        Load shared libraries (e.g. '_stash.libcore') on first access.
+        This is only called when the normal attribute lookup fails.
+        """
+        lib_files = self.__dict__.get('_lib_files', None)
+        if lib_files is None or name not in lib_files:
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+        return self._load_lib_module(name)
+
+    def __dir__(self):
+        # include libraries which are not loaded yet
+        return sorted(set(dir(self.__class__)) | set(self.__dict__) | set(self._lib_files))
 
     def __call__(self, input_, persistent_level=2, *args, **kwargs):
         """ This function is to be called by external script for
          executing shell commands """
+        check_cancelled()
         worker = self.runtime.run(input_, persistent_level=persistent_level, *args, **kwargs)
         worker.join()
+        check_cancelled()
         return worker
 
     @staticmethod
@@ -255,23 +292,67 @@ class StaSh(object):
 
     def _load_lib(self):
         """
-        Load library files as modules and save each of them as attributes
+        Find library files. Each of them is loaded as a module and saved
+        as an attribute the first time it is accessed.
         """
         lib_path = os.path.join(_STASH_ROOT, 'lib')
-        os.environ['STASH_ROOT'] = _STASH_ROOT  # libcompleter needs this value
-        try:
-            for f in os.listdir(lib_path):
-                fp = os.path.join(lib_path, f)
-                if f.startswith('lib') and f.endswith('.py') and os.path.isfile(fp):
-                    name, _ = os.path.splitext(f)
-                    if self.runtime.debug:
-                        self.logger.debug("Attempting to load library '{}'...".format(name))
-                    try:
-                        self.__dict__[name] = pyimp.load_source(name, fp)
-                    except Exception as e:
-                        self.write_message('%s: failed to load library file (%s)' % (f, repr(e)), error=True)
-        finally:  # do not modify environ permanently
-            os.environ.pop('STASH_ROOT')
+        for f in os.listdir(lib_path):
+            fp = os.path.join(lib_path, f)
+            if f.startswith('lib') and f.endswith('.py') and os.path.isfile(fp):
+                name, _ = os.path.splitext(f)
+                self._lib_files[name] = fp
+
+    def _load_lib_module(self, name):
+        """
+        Load a library file as a module and save it as an attribute.
+        :param name: name of the library, e.g. 'libcore'
+        :type name: str
+        :return: the loaded library
+        :rtype: module
+        """
+        with self._lib_lock:
+            if name in self.__dict__:  # loaded by another thread
+                return self.__dict__[name]
+            fp = self._lib_files[name]
+            if self.runtime.debug:
+                self.logger.debug("Attempting to load library '{}'...".format(name))
+            saved_stash_root = os.environ.get('STASH_ROOT', None)
+            os.environ['STASH_ROOT'] = _STASH_ROOT  # libcompleter needs this value
+            try:
+                self.__dict__[name] = pyimp.load_source(name, fp)
+            except Exception as e:
+                # do not try again
+                del self._lib_files[name]
+                self.write_message('%s: failed to load library file (%s)' % (os.path.basename(fp), repr(e)), error=True)
+                raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+            finally:  # do not modify environ permanently
+                if saved_stash_root is None:
+                    os.environ.pop('STASH_ROOT')
+                else:
+                    os.environ['STASH_ROOT'] = saved_stash_root
+            return self.__dict__[name]
+
+    def _record_startup_phase(self, name):
+        """
+        Record the time spent in a startup phase since the last recorded phase.
+        :param name: name of the phase
+        :type name: str
+        """
+        now = time.time()
+        self.startup_times[name] = now - self._startup_last
+        self._startup_last = now
+
+    def get_startup_report(self):
+        """
+        Return a per-phase timing breakdown of the startup.
+        :return: the startup report
+        :rtype: str
+        """
+        lines = ['StaSh startup profile:']
+        for name, duration in self.startup_times.items():
+            lines.append('  {:<10s} {:8.1f} ms'.format(name, duration * 1000))
+        lines.append('  {:<10s} {:8.1f} ms'.format('total', (self._startup_last - self._startup_t0) * 1000))
+        return '\n'.join(lines)
 
     def write_message(self, s, error=False, prefix="stash: "):
         """
@@ -44,6 +44,7 @@ ap.add_argument(
 ap.add_argument('--log-file', help='the file to send logging messages')
 ap.add_argument('--debug-switch', default='', help='a comma separate list to turn on debug switch for components')
 ap.add_argument('-c', '--command', default=None, dest='command', help='command to run')
+ap.add_argument('--profile-startup', action='store_true', help='print a per-phase timing breakdown of the startup')
 ap.add_argument('args',  # the editor shortcuts may pass additional arguments
                 nargs='*',
                 help='additional arguments (ignored)')
@@ -100,6 +101,9 @@ _stash = stash.StaSh(
     command=ctp,
 )
 
+if ns.profile_startup:
+    print(_stash.get_startup_report())
+
 _stash.launch(ns.command)
 if ns.command is not None:
     # TODO: _stash.launch() may block, which prevents this from being executed
@@ -8,6 +8,7 @@ import platform
 import functools
 import threading
 import ctypes
+from collections import OrderedDict
 from itertools import chain
 
 import six
@@ -205,6 +206,82 @@ def sh_background(name=None):
     return wrap
 
 
+class ShLRUCache(object):
+    """
+    A bounded, thread-safe mapping which discards the least recently used
+    entries first. Hits and misses are counted for debugging.
+    :param maxsize: maximum number of entries
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        Return the value for key and mark it as recently used.
+        :param key: key to look up
+        :param default: value to return if key is not cached
+        :return: the cached value or default
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache value for key, discarding the least recently used entry if full.
+        :param key: key to cache the value for
+        :param value: value to cache
+        """
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > max(0, self.maxsize):
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    @property
+    def hit_rate(self):
+        """
+        The ratio of hits to lookups, 0.0 if there were no lookups.
+        :rtype: float
+        """
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        """
+        Return a short description of the cache usage for debug logging.
+        :rtype: str
+        """
+        return 'size %d/%d, hits %d, misses %d, hit rate %.1f%%' % (
+            len(self._data), self.maxsize, self.hits, self.misses, self.hit_rate * 100)
+
+
 class ShFileNotFound(Exception):
     pass
 
@@ -234,6 +311,23 @@ class ShSyntaxError(Exception):
     pass
 
 
+class ShParseError(ShSyntaxError):
+    """
+    Raised when a line does not match the shell grammar.
+    :param pstr: the string being parsed
+    :type pstr: str
+    :param loc: the position in pstr where parsing failed
+    :type loc: int
+    :param msg: a description of the error
+    :type msg: str
+    """
+    def __init__(self, pstr, loc, msg=''):
+        super(ShParseError, self).__init__(msg)
+        self.pstr = pstr
+        self.loc = loc
+        self.msg = msg
+
+
 class ShInternalError(Exception):
     pass
 
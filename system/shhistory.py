@@ -4,6 +4,7 @@ StaSh input history
 """
 from io import open
 import json
+import threading
 
 from .shcommon import ShEventNotFound
 
@@ -28,6 +29,7 @@ class ShHistory(object):
         self.maxsize = self.stash.config.getint("history", "maxsize")
         self.templine = ""
         self.idx = -1
+        self._loader = None
 
     @classmethod
     def load(cls, path, stash):
@@ -49,6 +51,41 @@ class ShHistory(object):
         shh._histories = h
         return shh
 
+    @classmethod
+    def load_in_background(cls, path, stash):
+        """
+        Load the history from a path in a background thread.
+        A nonexistent or unreadable file results in an empty history.
+        The loading is awaited when the history is first used.
+        :param path: path to load from.
+        :type path: str
+        :param stash: the StaSh core
+        :type stash: StaSh
+        :return: the history being loaded
+        :rtype: ShHistory
+        """
+        shh = cls(stash)
+
+        def _load():
+            try:
+                shh._histories = cls.load(path, stash)._histories
+            except IOError:
+                pass
+
+        shh._loader = threading.Thread(name="StaSh.history_loader", target=_load)
+        shh._loader.daemon = True
+        shh._loader.start()
+        return shh
+
+    def _wait_for_loader(self):
+        """
+        Wait until the history started by load_in_background() is loaded.
+        """
+        loader = self._loader
+        if loader is not None:
+            loader.join()
+            self._loader = None
+
     @classmethod
     def load_old_format(cls, path):
         """
@@ -68,6 +105,7 @@ class ShHistory(object):
         :param path: path to save to.
         :type path: str
         """
+        self._wait_for_loader()
         with open(path, "w", encoding=self.ENCODING) as fout:
             s = json.dumps(self._histories)
             fout.write(u"" + s)  # ensure unicode
@@ -78,6 +116,7 @@ class ShHistory(object):
         :param target: history to clear or None for current
         :type history: str or None
         """
+        self._wait_for_loader()
         if target is None:
             target = self._current
         if target in self._histories:
@@ -87,6 +126,7 @@ class ShHistory(object):
         """
         Clear all histories.
         """
+        self._wait_for_loader()
         self._histories = {}
 
     def swap(self, target):
@@ -105,6 +145,7 @@ class ShHistory(object):
         :param always: always add this line, regardless of config
         :type always: bool
         """
+        self._wait_for_loader()
         if self._current not in self._histories:
             self._histories[self._current] = []
         stripped = line.strip()
@@ -131,6 +172,7 @@ class ShHistory(object):
         :return: list of current history entries
         :rtype: list of str
         """
+        self._wait_for_loader()
         if self._current not in self._histories:
             self._histories[self._current] = []
         return self._histories[self._current][::-1]
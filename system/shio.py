@@ -1,8 +1,9 @@
 # coding: utf-8
 import logging
-import time
 from collections import deque
 
+from .shthreads import cancellable_sleep, check_cancelled
+
 
 class ShIO(object):
     """
@@ -72,7 +73,7 @@ class ShIO(object):
                     ret.append(self._buffer.pop())
                 except IndexError:
                     # Wait briefly when the buffer is empty to avoid taxing the CPU
-                    time.sleep(self.holdback)
+                    cancellable_sleep(self.holdback)
 
             return ''.join(ret)
 
@@ -84,7 +85,7 @@ class ShIO(object):
                 if ret[-1] in ['\n', '\0']:
                     break
             except IndexError:
-                time.sleep(self.holdback)
+                cancellable_sleep(self.holdback)
 
         if ret[-1] == '\0':
             del ret[-1]
@@ -104,7 +105,7 @@ class ShIO(object):
                 if ret[-1] == '\0':
                     break
             except IndexError:
-                time.sleep(self.holdback)
+                cancellable_sleep(self.holdback)
 
         ret = ''.join(ret[:-1])  # do not include the EOF
 
@@ -131,7 +132,7 @@ class ShIO(object):
                 try:
                     yield self._buffer.pop()
                 except IndexError:
-                    time.sleep(self.holdback)
+                    cancellable_sleep(self.holdback)
 
         finally:
             self.stash.mini_buffer.cbreak = False
@@ -157,6 +158,7 @@ class ShIO(object):
                 break
 
     def write(self, s, no_wait=False):
+        check_cancelled()
         if len(s) == 0:  # skip empty string
             return
         idx = 0
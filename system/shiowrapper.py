@@ -2,44 +2,151 @@
 """
 The wrappers dispatch io requests based on current thread.
 
-If the thread is an instance of ShBaseThread, the io should be dispatched to ShIO.
-Otherwise, it should be dispatched to regular sys io.
+If the thread is an instance of ShBaseThread, the io should be dispatched to
+the streams of its state. Otherwise, it should be dispatched to regular sys io.
+The streams are looked up in a threading.local, see bind().
 """
 import sys
 import threading
 
 from .shcommon import _SYS_STDIN, _SYS_STDOUT, _SYS_STDERR
-from .shthreads import ShBaseThread
+
+# The io through these methods is counted in the ShJobStats of a worker
+_READ_METHODS = ('read', 'readline', 'readlines')
+_WRITE_METHODS = ('write', 'writelines')
+
+
+def _counted_write(item, write, stats, name, token):
+    """
+    Wrap the write or writelines method of a stream so that the size of the
+    written data is added to the stdout_size or stderr_size of a ShJobStats.
+    The write is also a check point for the ShCancellationToken of the worker.
+    """
+    if item == 'writelines':
+        def counted(lines):
+            token.check()
+            lines = list(lines)
+            setattr(stats, name, getattr(stats, name) + sum(len(line) for line in lines))
+            return write(lines)
+    # write() is called most often, so it avoids any indirection that can be avoided
+    elif name == 'stdout_size':
+        def counted(s, *args, **kwargs):
+            if token.cancelled:
+                raise KeyboardInterrupt()
+            stats.stdout_size += len(s)
+            if args or kwargs:
+                return write(s, *args, **kwargs)
+            return write(s)
+    else:
+        def counted(s, *args, **kwargs):
+            if token.cancelled:
+                raise KeyboardInterrupt()
+            stats.stderr_size += len(s)
+            if args or kwargs:
+                return write(s, *args, **kwargs)
+            return write(s)
+    return counted
+
+
+def _counted_read(item, read, stats, token):
+    """
+    Wrap a read method of a stream so that the lines read are added to
+    the stdin_lines of a ShJobStats.
+    The read is also a check point for the ShCancellationToken of the worker.
+    """
+    def counted(*args, **kwargs):
+        token.check()
+        data = read(*args, **kwargs)
+        if isinstance(data, list):  # readlines
+            stats.stdin_lines += len(data)
+        elif item == 'readline':
+            stats.stdin_lines += 1 if data else 0
+        else:
+            stats.stdin_lines += data.count(b'\n' if isinstance(data, bytes) else u'\n')
+        return data
+    return counted
+
+
+def _bound_methods(stream, names):
+    """
+    Return the methods of a stream which exist.
+    :rtype: dict
+    """
+    methods = {}
+    for name in names:
+        method = getattr(stream, name, None)
+        if method is not None:
+            methods[name] = method
+    return methods
+
+
+class ShThreadIO(threading.local):
+    """
+    The streams the wrappers dispatch to in the current thread and the methods
+    of the streams which are looked up most often. Threads other than workers
+    see the class attributes, i.e. the regular sys io. A worker binds its own
+    streams with bind().
+    """
+    worker = None
+    stdin = _SYS_STDIN
+    stdout = _SYS_STDOUT
+    stderr = _SYS_STDERR
+    stdin_methods = _bound_methods(_SYS_STDIN, _READ_METHODS)
+    stdout_methods = _bound_methods(_SYS_STDOUT, _WRITE_METHODS + ('flush', ))
+    stderr_methods = _bound_methods(_SYS_STDERR, _WRITE_METHODS + ('flush', ))
+
+
+thread_io = ShThreadIO()
+
+
+def bind(worker):
+    """
+    Let the wrappers of the current thread dispatch to the streams of the state
+    of a worker. This has to be called from the thread of the worker when it
+    starts and whenever its state or the streams of its state change.
+    :param worker: the worker running in the current thread
+    :type worker: ShBaseThread
+    """
+    state = worker.state
+    stats = worker.stats
+    token = worker.cancel_token
+    thread_io.worker = worker
+
+    thread_io.stdin = state.sys_stdin
+    thread_io.stdin_methods = dict(
+        (item, _counted_read(item, read, stats, token)) for item, read in _bound_methods(state.sys_stdin, _READ_METHODS).items()
+    )
+
+    for name, stream in (('stdout', state.sys_stdout), ('stderr', state.sys_stderr)):
+        methods = _bound_methods(stream, ('flush', ))
+        for item, write in _bound_methods(stream, _WRITE_METHODS).items():
+            methods[item] = _counted_write(item, write, stats, name + '_size', token)
+        setattr(thread_io, name, stream)
+        setattr(thread_io, name + '_methods', methods)
 
 
 class ShStdinWrapper(object):
     def __getattribute__(self, item):
-        thread = threading.currentThread()
-
-        if isinstance(thread, ShBaseThread):
-            return getattr(thread.state.sys_stdin, item)
-        else:
-            return getattr(_SYS_STDIN, item)
+        try:
+            return thread_io.stdin_methods[item]
+        except KeyError:
+            return getattr(thread_io.stdin, item)
 
 
 class ShStdoutWrapper(object):
     def __getattribute__(self, item):
-        thread = threading.currentThread()
-
-        if isinstance(thread, ShBaseThread):
-            return getattr(thread.state.sys_stdout, item)
-        else:
-            return getattr(_SYS_STDOUT, item)
+        try:
+            return thread_io.stdout_methods[item]
+        except KeyError:
+            return getattr(thread_io.stdout, item)
 
 
 class ShStderrWrapper(object):
     def __getattribute__(self, item):
-        thread = threading.currentThread()
-
-        if isinstance(thread, ShBaseThread):
-            return getattr(thread.state.sys_stderr, item)
-        else:
-            return getattr(_SYS_STDERR, item)
+        try:
+            return thread_io.stderr_methods[item]
+        except KeyError:
+            return getattr(thread_io.stderr, item)
 
 
 stdinWrapper = ShStdinWrapper()
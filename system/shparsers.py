@@ -1,16 +1,15 @@
 # coding: utf-8
 
 import os
+import re
 import string
-import glob
+import fnmatch
 import logging
 import threading
 
 from six import StringIO
 
-import pyparsing as pp
-
-from .shcommon import ShSingleExpansionRequired, ShBadSubstitution, ShInternalError
+from .shcommon import ShSingleExpansionRequired, ShBadSubstitution, ShInternalError, ShLRUCache, ShParseError
 
 _GRAMMAR = r"""
 -----------------------------------------------------------------------------
@@ -46,6 +45,26 @@ uq_word          : (WORD_CHARS)+ | '&3'
 
 _WORD_CHARS = string.digits + string.ascii_letters + r'''!#$%()*+,-./:=?@[]^_{}~'''
 
+# Character classes and patterns of the native parser. They mirror the
+# pyparsing grammar built in ShParser._build_grammar().
+_PRINTABLES = ''.join(chr(c) for c in range(33, 127))
+_ESCAPABLE_CHARS = frozenset(_PRINTABLES + ' ')
+_UQ_WORD_CHARS = frozenset(_WORD_CHARS)
+_SKIP_RE = re.compile(r'(?:[ \t\n\r]+|#[^\n]*)*')  # whitespace and comments
+_UQ_WORD_RE = re.compile('[%s]+' % re.escape(_WORD_CHARS))
+_UQ_WORD_IN_DQ_RE = re.compile('[%s]+' % re.escape(_PRINTABLES.replace('`', ' ').replace('\\', '')))
+_OCT_RE = re.compile(r'[0-7]+')
+_HEX_RE = re.compile(r'[0-9a-fA-F]{2}')
+_ASSIGN_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+_GLOB_MAGIC_RE = re.compile(r'[*?[]')
+_VAR_RE = re.compile(r'\$(?:([0-9@#?$])|([A-Za-z_][A-Za-z0-9_]*)|\{)')
+_PARAMETER_RE = re.compile(r'(#?)([0-9@#?]|[A-Za-z0-9_]+)(?:(:-|-|:=|=|:\+|\+|##|#|%%|%)(.*))?$', re.DOTALL)
+_QUOTED_RES = {
+    '`': (re.compile(r'`(?:[^`\n\r\\]|(?:\\.))*`'), '_BQ_WORD'),
+    '"': (re.compile(r'"(?:[^"\n\r\\]|(?:\\.))*"'), '_DQ_WORD'),
+    "'": (re.compile(r"'(?:[^'\n\r\\]|(?:\\.))*'"), '_SQ_WORD'),
+}
+
 
 class ShAssignment(object):
     def __init__(self, identifier, value):
@@ -149,6 +168,298 @@ class ShToken(object):
         ret = '{%s %d-%d %s %s}' % (self.tok, self.spos, self.epos, self.ttype, self.parts)
         return ret
 
+    def copy(self):
+        """ Return a deep copy of the token, including its parts
+        """
+        if isinstance(self.parts, ShToken):
+            parts = self.parts.copy()
+        elif self.parts is not None:
+            parts = [p.copy() for p in self.parts]
+        else:
+            parts = None
+        t = ShToken(self.tok, self.spos, self.ttype, parts)
+        t.epos = self.epos
+        return t
+
+
+class ShParsedCommand(list):
+    """
+    A simple command as returned by the native parser engine.
+    Like the pyparsing results it replaces, this is the list of matched
+    strings with the named parts available as attributes.
+    """
+
+    def __init__(self):
+        super(ShParsedCommand, self).__init__()
+        self.cmd_prefix = []
+        self.cmd_word = ''
+        self.args = []
+        self.io_redirect = []
+
+
+class ShNativeParser(object):
+    """
+    Hand-written single pass lexer and recursive descent parser for one line.
+    It accepts the same grammar as the pyparsing based parser and produces the
+    same tokens and parse structure, except for an invalid assignment like
+    'x=' in command position, whose parts are a plain list here.
+
+    :param line: the line to parse
+    :type line: str
+    """
+
+    def __init__(self, line):
+        self.line = line
+        self.n = len(line)
+        self.tokens = []
+
+    def skip(self, pos):
+        """ Return the position after any whitespace and comments at pos
+        """
+        return _SKIP_RE.match(self.line, pos).end()
+
+    def parse(self):
+        """ Parse the line as a complete command.
+
+        :return: the tokens and the parse structure
+        :rtype: (list of ShToken, list)
+        """
+        line, n = self.line, self.n
+        tokens = self.tokens
+        parsed = []
+        end = 0
+        ret = self.pipe_sequence(self.skip(0))
+        if ret is not None:
+            end, pseq = ret
+            parsed.append(pseq)
+            while True:
+                pos = self.skip(end)
+                if pos == n or line[pos] not in ';&':
+                    break
+                tokens.append(ShToken(line[pos], pos, ShToken._PUNCTUATOR))
+                parsed.append(line[pos])
+                end = pos + 1
+                ret = self.pipe_sequence(self.skip(end))
+                if ret is None:
+                    break  # trailing punctuator
+                end, pseq = ret
+                parsed.append(pseq)
+        pos = self.skip(end)
+        if pos != n:
+            raise ShParseError(line, pos, 'Expected end of text')
+        return tokens, parsed
+
+    def parse_within_dq(self):
+        """ Parse the line as the content of a pair of double quotes.
+
+        :return: the parts and the parse structure
+        :rtype: (list of ShToken, list)
+        """
+        line, n = self.line, self.n
+        parts = []
+        pos = 0
+        while pos < n:
+            c = line[pos]
+            if c == '\\':
+                end, ttype = self.escaped(pos)
+            elif c == '`':
+                m = _QUOTED_RES[c][0].match(line, pos)
+                end, ttype = (m.end(), ShToken._BQ_WORD) if m else (None, None)
+            else:
+                m = _UQ_WORD_IN_DQ_RE.match(line, pos)
+                end, ttype = (m.end(), ShToken._UQ_WORD) if m else (None, None)
+            if end is None:
+                break
+            parts.append(ShToken(line[pos:end], pos, ttype))
+            pos = end
+        rest = line[pos:].lstrip(' \t\n\r')
+        if not parts or rest:
+            raise ShParseError(line, n - len(rest), 'Expected word within double quotes')
+        return parts, [line[:pos]]
+
+    def pipe_sequence(self, pos):
+        """ Parse a pipe sequence starting at pos.
+
+        :return: the end position and the parsed pipe sequence or None
+        """
+        line, n = self.line, self.n
+        ret = self.simple_command(pos)
+        if ret is None:
+            return None
+        end, cmd = ret
+        pseq = [cmd]
+        while True:
+            pos = self.skip(end)
+            if pos == n or line[pos] != '|':
+                break
+            mark = len(self.tokens)
+            self.tokens.append(ShToken('|', pos, ShToken._PIPE_OP))
+            ret = self.simple_command(self.skip(pos + 1))
+            if ret is None:
+                del self.tokens[mark:]
+                break
+            end, cmd = ret
+            pseq.extend(('|', cmd))
+        return end, pseq
+
+    def simple_command(self, pos):
+        """ Parse a simple command starting at pos.
+
+        :return: the end position and the parsed command or None
+        """
+        tokens = self.tokens
+        cmd = ShParsedCommand()
+        end = pos
+        while True:
+            ret = self.assignment_word(self.skip(end))
+            if ret is None:
+                break
+            end, token = ret
+            tokens.append(token)
+            cmd.cmd_prefix.append(token.tok)
+
+        if cmd.cmd_prefix:
+            cmd.extend(cmd.cmd_prefix)
+            ret = self.cmd_word(self.skip(end))
+        else:
+            ret = self.cmd_word(pos)
+            if ret is None:
+                return None
+        if ret is not None:
+            end, token = ret
+            tokens.append(token)
+            cmd.cmd_word = token.tok
+            cmd.append(token.tok)
+
+        end = self.cmd_suffix(self.skip(end), cmd) or end
+        return end, cmd
+
+    def cmd_suffix(self, pos, cmd):
+        """ Parse the arguments and the io redirect of a command starting at pos.
+
+        :return: the end position or None if nothing matches
+        """
+        tokens = self.tokens
+        end, parts = self.word(pos)
+        if not parts:
+            return self.io_redirect(pos, cmd)
+        while parts:
+            tok = self.line[pos:end]
+            tokens.append(ShToken(tok, pos, ShToken._WORD, parts))
+            cmd.args.append(tok)
+            cmd.append(tok)
+            pos = self.skip(end)
+            wend, parts = self.word(pos)
+            if parts:
+                end = wend
+        return self.io_redirect(pos, cmd) or end
+
+    def io_redirect(self, pos, cmd):
+        """ Parse an io redirect starting at pos.
+
+        :return: the end position or None if nothing matches
+        """
+        line = self.line
+        if line.startswith('>>', pos):
+            op = '>>'
+        elif line.startswith('>', pos):
+            op = '>'
+        else:
+            return None
+        fpos = self.skip(pos + len(op))
+        end, parts = self.word(fpos)
+        if not parts:
+            return None
+        filename = line[fpos:end]
+        self.tokens.append(ShToken(op, pos, ShToken._IO_REDIRECT_OP))
+        self.tokens.append(ShToken(filename, fpos, ShToken._FILE, parts))
+        cmd.io_redirect = [op, filename]
+        cmd.extend(cmd.io_redirect)
+        return end
+
+    def assignment_word(self, pos):
+        """ Parse an assignment starting at pos.
+
+        :return: the end position and the token or None
+        """
+        m = _ASSIGN_RE.match(self.line, pos)
+        if m is None:
+            return None
+        vpos = m.end()
+        end, parts = self.word(vpos)
+        if not parts:
+            return None
+        value = ShToken(self.line[vpos:end], vpos, ShToken._WORD, parts)
+        return end, ShToken(self.line[pos:end], pos, ShToken._ASSIGN_WORD, value)
+
+    def cmd_word(self, pos):
+        """ Parse a command word with an optional modifier starting at pos.
+
+        :return: the end position and the token or None
+        """
+        end, parts = self.word(pos)
+        if pos < self.n and self.line[pos] in '!\\':
+            # The modifier is not part of the word parts unless the word
+            # without the modifier is shorter
+            mend, mparts = self.word(pos + 1)
+            if mparts and (not parts or mend >= end):
+                end, parts = mend, mparts
+        if not parts:
+            return None
+        return end, ShToken(self.line[pos:end], pos, ShToken._CMD, parts)
+
+    def word(self, pos):
+        """ Parse a word starting at pos. Of the alternatives for every part
+        the longest match wins, ties are resolved in the order
+        escaped, escaped_oct, escaped_hex, uq_word, bq_word, dq_word and sq_word.
+
+        :return: the end position and the parts, which are empty if nothing matches
+        :rtype: (int, list of ShToken)
+        """
+        line, n = self.line, self.n
+        parts = []
+        while pos < n:
+            c = line[pos]
+            if c in _UQ_WORD_CHARS:
+                end = _UQ_WORD_RE.match(line, pos).end()
+                ttype = ShToken._UQ_WORD
+            elif c == '\\':
+                end, ttype = self.escaped(pos)
+                if end is None:
+                    break
+            elif c == '&' and line.startswith('&3', pos):
+                end = pos + 2
+                ttype = ShToken._UQ_WORD
+            elif c in _QUOTED_RES:
+                regex, ttype = _QUOTED_RES[c]
+                m = regex.match(line, pos)
+                if m is None:
+                    break
+                end = m.end()
+            else:
+                break
+            parts.append(ShToken(line[pos:end], pos, ttype))
+            pos = end
+        return pos, parts
+
+    def escaped(self, pos):
+        """ Parse an escape sequence starting at the backslash at pos.
+
+        :return: the end position and the token type or (None, None)
+        """
+        line, n = self.line, self.n
+        end, ttype = None, None
+        if pos + 1 < n and line[pos + 1] in _ESCAPABLE_CHARS:
+            end, ttype = pos + 2, ShToken._ESCAPED
+        m = _OCT_RE.match(line, pos + 1)
+        # at most 3 digits and no further octal digit may follow
+        if m is not None and m.end() - pos <= 4 and (end is None or m.end() > end):
+            end, ttype = m.end(), ShToken._ESCAPED_OCT
+        if line.startswith('x', pos + 1) and _HEX_RE.match(line, pos + 2) \
+                and (end is None or pos + 4 > end):
+            end, ttype = pos + 4, ShToken._ESCAPED_HEX
+        return end, ttype
+
 
 # noinspection PyProtectedMember
 class ShParser(object):
@@ -160,79 +471,148 @@ class ShParser(object):
     _NEXT_WORD_VAL = '_NEXT_WORD_VAL'  # rhs of assignment
     _NEXT_WORD_FILE = '_NEXT_WORD_FILE'
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, cache_size=256, engine='native'):
 
         self.debug = debug
         self.logger = logging.getLogger('StaSh.Parser')
 
-        escaped = pp.Combine("\\" + pp.Word(pp.printables + ' ', exact=1)).setParseAction(self.escaped_action)
-        escaped_oct = pp.Combine("\\" + pp.Word('01234567', max=3)).setParseAction(self.escaped_oct_action)
-        escaped_hex = pp.Combine("\\x" + pp.Word('0123456789abcdefABCDEF', exact=2)).setParseAction(self.escaped_hex_action)
-        # Some special uq_word is needed, e.g. &3 for file descriptor of Pythonista interactive prompt
-        uq_word = (pp.Literal('&3') | pp.Word(_WORD_CHARS)).setParseAction(self.uq_word_action)
-        bq_word = pp.QuotedString('`', escChar='\\', unquoteResults=False).setParseAction(self.bq_word_action)
-        dq_word = pp.QuotedString('"', escChar='\\', unquoteResults=False).setParseAction(self.dq_word_action)
-        sq_word = pp.QuotedString("'", escChar='\\', unquoteResults=False).setParseAction(self.sq_word_action)
-        # The ^ operator means longest match (as opposed to | which means first match)
-        word = pp.Combine(pp.OneOrMore(escaped ^ escaped_oct ^ escaped_hex
-                                       ^ uq_word ^ bq_word ^ dq_word ^ sq_word))\
-            .setParseAction(self.word_action)
-
-        identifier = pp.Word(pp.alphas + '_', pp.alphas + pp.nums + '_').setParseAction(self.identifier_action)
-        assign_op = pp.Literal('=').setParseAction(self.assign_op_action)
-        assignment_word = pp.Combine(identifier + assign_op + word).setParseAction(self.assignment_word_action)
-
-        punctuator = pp.oneOf('; &').setParseAction(self.punctuator_action)
-        pipe_op = pp.Literal('|').setParseAction(self.pipe_op_action)
-        io_redirect_op = pp.oneOf('>> >').setParseAction(self.io_redirect_op_action)
-        io_redirect = (io_redirect_op + word)('io_redirect')
-
-        # The optional ' ' is a workaround to a possible bug in pyparsing.
-        # The position of cmd_word after cmd_prefix is always reported 1 character ahead
-        # of the correct value.
-        cmd_prefix = (pp.OneOrMore(assignment_word) + pp.Optional(' '))('cmd_prefix')
-        cmd_suffix = (pp.OneOrMore(word)('args') + pp.Optional(io_redirect)) ^ io_redirect
-
-        modifier = pp.oneOf('! \\')
-        cmd_word = (pp.Combine(pp.Optional(modifier) + word) ^ word)('cmd_word').setParseAction(self.cmd_word_action)
-
-        simple_command = \
-            (cmd_prefix + pp.Optional(cmd_word) + pp.Optional(cmd_suffix)) \
-            | (cmd_word + pp.Optional(cmd_suffix))
-        simple_command = pp.Group(simple_command)
-
-        pipe_sequence = simple_command + pp.ZeroOrMore(pipe_op + simple_command)
-        pipe_sequence = pp.Group(pipe_sequence)
-
-        complete_command = pp.Optional(pipe_sequence + pp.ZeroOrMore(punctuator + pipe_sequence) + pp.Optional(punctuator))
-
-        # --- special parser for inside double quotes
-        uq_word_in_dq = pp.Word(pp.printables.replace('`', ' ').replace('\\', ''))\
-            .setParseAction(self.uq_word_action)
-        word_in_dq = pp.Combine(pp.OneOrMore(escaped ^ escaped_oct ^ escaped_hex ^ bq_word ^ uq_word_in_dq))
-        # ---
-
-        self.parser = complete_command.parseWithTabs().ignore(pp.pythonStyleComment)
-        self.parser_within_dq = word_in_dq.leaveWhitespace()
+        # 'native' uses ShNativeParser, 'pyparsing' the pyparsing grammar.
+        # pyparsing is only imported if its engine is selected.
+        self.engine = engine if engine in ('native', 'pyparsing') else 'native'
+
+        # Parse results keyed by line. The parse actions work on shared state,
+        # so the actual parsing is serialized.
+        self.cache = ShLRUCache(cache_size)
+        self._parse_lock = threading.RLock()
+
+        # The grammar is expensive to build and only needed once the
+        # first line is parsed, see _build_grammar()
+        self.parser = None
+        self.parser_within_dq = None
+        self._grammar_lock = threading.Lock()
         self.next_word_type = ShParser._NEXT_WORD_CMD
         self.tokens = []
         self.parts = []
 
+    def _build_grammar(self):
+        """ Build the pyparsing grammar if it is not built yet
+        """
+        import pyparsing as pp
+
+        with self._grammar_lock:
+            if self.parser is not None:
+                return
+            if self.debug:
+                self.logger.debug('building grammar')
+
+            escaped = pp.Combine("\\" + pp.Word(pp.printables + ' ', exact=1)).setParseAction(self.escaped_action)
+            escaped_oct = pp.Combine("\\" + pp.Word('01234567', max=3)).setParseAction(self.escaped_oct_action)
+            escaped_hex = pp.Combine("\\x" + pp.Word('0123456789abcdefABCDEF', exact=2)).setParseAction(self.escaped_hex_action)
+            # Some special uq_word is needed, e.g. &3 for file descriptor of Pythonista interactive prompt
+            uq_word = (pp.Literal('&3') | pp.Word(_WORD_CHARS)).setParseAction(self.uq_word_action)
+            bq_word = pp.QuotedString('`', escChar='\\', unquoteResults=False).setParseAction(self.bq_word_action)
+            dq_word = pp.QuotedString('"', escChar='\\', unquoteResults=False).setParseAction(self.dq_word_action)
+            sq_word = pp.QuotedString("'", escChar='\\', unquoteResults=False).setParseAction(self.sq_word_action)
+            # The ^ operator means longest match (as opposed to | which means first match)
+            word = pp.Combine(pp.OneOrMore(escaped ^ escaped_oct ^ escaped_hex
+                                           ^ uq_word ^ bq_word ^ dq_word ^ sq_word))\
+                .setParseAction(self.word_action)
+
+            identifier = pp.Word(pp.alphas + '_', pp.alphas + pp.nums + '_').setParseAction(self.identifier_action)
+            assign_op = pp.Literal('=').setParseAction(self.assign_op_action)
+            assignment_word = pp.Combine(identifier + assign_op + word).setParseAction(self.assignment_word_action)
+
+            punctuator = pp.oneOf('; &').setParseAction(self.punctuator_action)
+            pipe_op = pp.Literal('|').setParseAction(self.pipe_op_action)
+            io_redirect_op = pp.oneOf('>> >').setParseAction(self.io_redirect_op_action)
+            io_redirect = (io_redirect_op + word)('io_redirect')
+
+            # The optional ' ' is a workaround to a possible bug in pyparsing.
+            # The position of cmd_word after cmd_prefix is always reported 1 character ahead
+            # of the correct value.
+            cmd_prefix = (pp.OneOrMore(assignment_word) + pp.Optional(' '))('cmd_prefix')
+            cmd_suffix = (pp.OneOrMore(word)('args') + pp.Optional(io_redirect)) ^ io_redirect
+
+            modifier = pp.oneOf('! \\')
+            cmd_word = (pp.Combine(pp.Optional(modifier) + word) ^ word)('cmd_word').setParseAction(self.cmd_word_action)
+
+            simple_command = \
+                (cmd_prefix + pp.Optional(cmd_word) + pp.Optional(cmd_suffix)) \
+                | (cmd_word + pp.Optional(cmd_suffix))
+            simple_command = pp.Group(simple_command)
+
+            pipe_sequence = simple_command + pp.ZeroOrMore(pipe_op + simple_command)
+            pipe_sequence = pp.Group(pipe_sequence)
+
+            complete_command = pp.Optional(pipe_sequence + pp.ZeroOrMore(punctuator + pipe_sequence) + pp.Optional(punctuator))
+
+            # --- special parser for inside double quotes
+            uq_word_in_dq = pp.Word(pp.printables.replace('`', ' ').replace('\\', ''))\
+                .setParseAction(self.uq_word_action)
+            word_in_dq = pp.Combine(pp.OneOrMore(escaped ^ escaped_oct ^ escaped_hex ^ bq_word ^ uq_word_in_dq))
+            # ---
+
+            self.parser_within_dq = word_in_dq.leaveWhitespace()
+            self.parser = complete_command.parseWithTabs().ignore(pp.pythonStyleComment)
+
     def parse(self, line):
+        """ Parse a line and return its tokens and the parse results.
+        The tokens are a fresh copy on every call and may be modified. The
+        parse results are shared with the cache and must not be modified.
+        """
         if self.debug:
             self.logger.debug('line: %s' % repr(line))
-        self.next_word_type = ShParser._NEXT_WORD_CMD
-        self.tokens = []
-        self.parts = []
-        parsed = self.parser.parseString(line, parseAll=True)
-        return self.tokens, parsed
+        key = ('line', line)
+        cached = self.cache.get(key)
+        if cached is None:
+            if self.engine == 'native':
+                cached = ShNativeParser(line).parse()
+            else:
+                cached = self._parse_with_pyparsing(line)
+            self.cache.put(key, cached)
+        if self.debug:
+            self.logger.debug('parse cache: %s' % self.cache.stats())
+        tokens, parsed = cached
+        return [t.copy() for t in tokens], parsed
 
     def parse_within_dq(self, s):
         """ Take the input string as if it is inside a pair of double quotes
         """
-        self.parts = []
-        parsed = self.parser_within_dq.parseString(s, parseAll=True)
-        return self.parts, parsed
+        key = ('dq', s)
+        cached = self.cache.get(key)
+        if cached is None:
+            if self.engine == 'native':
+                # pyparsing expands tabs if not told otherwise
+                cached = ShNativeParser(s.expandtabs()).parse_within_dq()
+            else:
+                cached = self._parse_with_pyparsing(s, within_dq=True)
+            self.cache.put(key, cached)
+        if self.debug:
+            self.logger.debug('parse cache: %s' % self.cache.stats())
+        parts, parsed = cached
+        return [p.copy() for p in parts], parsed
+
+    def _parse_with_pyparsing(self, s, within_dq=False):
+        """ Parse a line or the content of double quotes with the pyparsing grammar.
+        Parse errors are reported as ShParseError like with the native engine.
+        """
+        import pyparsing as pp
+
+        if self.parser is None:
+            self._build_grammar()
+        with self._parse_lock:
+            self.next_word_type = ShParser._NEXT_WORD_CMD
+            self.tokens = []
+            self.parts = []
+            try:
+                if within_dq:
+                    parsed = self.parser_within_dq.parseString(s, parseAll=True)
+                    return self.parts, parsed
+                else:
+                    parsed = self.parser.parseString(s, parseAll=True)
+                    return self.tokens, parsed
+            except pp.ParseBaseException as e:
+                raise ShParseError(e.pstr, e.loc, e.msg)
 
     def identifier_action(self, s, pos, toks):
         """ This function is only needed for debug """
@@ -349,18 +729,36 @@ class ShExpander(object):
     :type stash: StaSh
     """
 
-    def __init__(self, stash, debug=False):
+    def __init__(self, stash, debug=False, cache_size=256):
         self.stash = stash
         self.debug = debug
         self.logger = logging.getLogger('StaSh.Expander')
-
-    def expand(self, line):
+        # Results of the alias pass keyed by line and alias table version
+        self.alias_cache = ShLRUCache(cache_size)
+        # Compiled fnmatch patterns for globbing
+        self.fnmatch_cache = ShLRUCache(cache_size)
+        # Directory listings for globbing, reset for every pipe sequence
+        self._local = threading.local()
+
+    def expand(self, line, template=None):
+        """ Expand a line into pipe sequences.
+        This is a generator which first yields the history expanded line and
+        the number of pipe sequences, followed by the pipe sequences. Each pipe
+        sequence is only expanded after the previous one has been run.
+
+        :param line: the line to expand
+        :param template: the tokens and parse results of the line if it has
+                         been parsed before, e.g. for a compiled script
+        """
 
         if self.debug:
             self.logger.debug('line: %s' % repr(line))
 
         # Parse the line
-        tokens, parsed = self.stash.runtime.parser.parse(line)
+        if template is None:
+            tokens, parsed = self.stash.runtime.parser.parse(line)
+        else:
+            tokens, parsed = [t.copy() for t in template[0]], template[1]
 
         # History (bang) check
         tokens, parsed = self.history_subs(tokens, parsed)
@@ -383,6 +781,9 @@ class ShExpander(object):
 
             # Due to the generator change, complete_command is redundant and removed
             pipe_sequence = ShPipeSequence()
+            # Directories are listed once per pipe sequence. Previous pipe
+            # sequences may have changed them.
+            self._local.listdir_cache = {}
 
             for isc in range(0, len(pseq), 2):
                 sc = pseq[isc]
@@ -391,7 +792,7 @@ class ShExpander(object):
                 for _ in sc.cmd_prefix:
                     t = tokens[idxt]
                     ident = t.tok[0:len(t.tok) - len(t.parts.tok) - 1]
-                    val = ' '.join(self.expand_word(t.parts))
+                    val = ' '.join(self.expand_word(t.parts, braces=False))
                     simple_command.assignments.append(ShAssignment(ident, val))
                     idxt += 1
 
@@ -461,11 +862,25 @@ class ShExpander(object):
         # any possible leading backslash or bang, e.g. \ls will not match
         # any alias because it is not a valid alias form.
         _, current_state = self.stash.runtime.get_current_worker_and_state()
+        aliases = current_state.aliases
+
+        # Changing the aliases changes their version, which invalidates the cache
+        key = None
+        if exclude is None and hasattr(aliases, 'version'):
+            key = (' '.join(t.tok for t in tokens), aliases.version)
+            cached = self.alias_cache.get(key)
+            if self.debug:
+                self.logger.debug('alias cache: %s' % self.alias_cache.stats())
+            if cached is not None:
+                if not cached:  # no alias in this line
+                    return tokens, parsed
+                cached_tokens, cached_parsed = cached
+                return [t.copy() for t in cached_tokens], cached_parsed
 
         alias_found = False
         for t in tokens:
-            if t.ttype == ShToken._CMD and t.tok in current_state.aliases.keys() and t.tok != exclude:
-                t.tok = current_state.aliases[t.tok][1]
+            if t.ttype == ShToken._CMD and t.tok in aliases.keys() and t.tok != exclude:
+                t.tok = aliases[t.tok][1]
                 alias_found = True
         if alias_found:
             # Replace all alias and re-parse the new line
@@ -473,28 +888,47 @@ class ShExpander(object):
             if self.debug:
                 self.logger.debug('alias found: %s' % line)
             tokens, parsed = self.stash.runtime.parser.parse(line)
+            if key is not None:
+                self.alias_cache.put(key, ([t.copy() for t in tokens], parsed))
+        elif key is not None:
+            self.alias_cache.put(key, ())
         return tokens, parsed
 
-    def expand_word(self, word):
+    def expand_word(self, word, braces=True):
         if self.debug:
             self.logger.debug(word.tok)
 
+        if braces:
+            alternatives = self.brace_alternatives(word.parts)
+            if len(alternatives) > 1:
+                fields = []
+                for parts in alternatives:
+                    tok = ''.join(p.tok for p in parts)
+                    fields.extend(self.expand_word(ShToken(tok, word.spos, word.ttype, parts), braces=False))
+                return fields
+
         words_expanded = []
         words_expanded_globable = []
+        # Whether a word has unescaped wildcards and needs to be globbed
+        words_magic = []
 
         w_expanded = w_expanded_globable = ''
+        w_magic = False
         for i, p in enumerate(word.parts):
+            magic = False
             if p.ttype == ShToken._ESCAPED:
                 ex, exg = self.expand_escaped(p.tok)
 
             elif p.ttype in [ShToken._ESCAPED_OCT, ShToken._ESCAPED_HEX]:
                 ex, exg = self.expand_escaped_oct_or_hex(p.tok)
+                magic = _GLOB_MAGIC_RE.search(exg) is not None
 
             elif p.ttype == ShToken._UQ_WORD:
                 if i == 0:  # first part in the word
                     ex = exg = self.expand_uq_word(self.expanduser(p.tok))
                 else:
                     ex = exg = self.expand_uq_word(p.tok)
+                magic = _GLOB_MAGIC_RE.search(exg) is not None
 
             elif p.ttype == ShToken._SQ_WORD:
                 ex, exg = self.expand_sq_word(p.tok)
@@ -510,22 +944,29 @@ class ShExpander(object):
                     words_expanded.extend(fields[1:-1])
                     words_expanded_globable.append(w_expanded_globable + fields[0])
                     words_expanded_globable.extend(fields[1:-1])
+                    words_magic.append(w_magic or _GLOB_MAGIC_RE.search(fields[0]) is not None)
+                    words_magic.extend(_GLOB_MAGIC_RE.search(f) is not None for f in fields[1:-1])
                     w_expanded = w_expanded_globable = ''
+                    w_magic = False
                     ex = exg = fields[-1]
                 else:
                     ex = exg = ret
+                magic = _GLOB_MAGIC_RE.search(exg) is not None
             else:
                 raise ShInternalError('%s: unknown word parts to expand' % p.ttype)
 
             w_expanded += ex
             w_expanded_globable += exg
+            w_magic = w_magic or magic
 
         words_expanded.append(w_expanded)
         words_expanded_globable.append(w_expanded_globable)
+        words_magic.append(w_magic)
 
         fields = []
-        for w_expanded, w_expanded_globable in zip(words_expanded, words_expanded_globable):
-            w_expanded_globbed = glob.glob(w_expanded_globable)
+        for w_expanded, w_expanded_globable, w_magic in zip(words_expanded, words_expanded_globable, words_magic):
+            # Words without unescaped wildcards can only glob to themselves
+            w_expanded_globbed = self.glob(w_expanded_globable) if w_magic else None
             if w_expanded_globbed:
                 fields.extend(w_expanded_globbed)
             else:
@@ -533,6 +974,118 @@ class ShExpander(object):
 
         return fields
 
+    def brace_alternatives(self, parts):
+        """ Apply brace expansion to the unquoted parts of a word.
+
+        :param parts: the parts of a word
+        :type parts: list of ShToken
+        :return: the parts of each word resulting from the expansion
+        :rtype: list of list of ShToken
+        """
+        alternatives = [[]]
+        for p in parts:
+            if p.ttype == ShToken._UQ_WORD and '{' in p.tok and ',' in p.tok:
+                toks = self.expand_braces(p.tok)
+            else:
+                toks = None
+            if toks is None or len(toks) == 1:
+                for parts in alternatives:
+                    parts.append(p)
+            else:
+                alternatives = [parts + [ShToken(tok, p.spos, ShToken._UQ_WORD)] for parts in alternatives for tok in toks]
+        return alternatives
+
+    def expand_braces(self, s):
+        """ Expand the braces of a string, e.g. a{b,c}d gives abd and acd.
+        Braces without a comma and parameter expansions like ${A} are kept.
+
+        :param s: string to expand
+        :type s: str
+        :return: the expanded strings
+        :rtype: list of str
+        """
+        start = s.find('{')
+        while start != -1:
+            if start == 0 or s[start - 1] != '$':
+                depth = 0
+                items = []
+                last = start + 1
+                for end in range(start, len(s)):
+                    c = s[end]
+                    if c == '{':
+                        depth += 1
+                    elif c == '}':
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    elif c == ',' and depth == 1:
+                        items.append(s[last:end])
+                        last = end + 1
+                if depth == 0 and items:
+                    items.append(s[last:end])
+                    prefix, suffix = s[:start], s[end + 1:]
+                    suffixes = self.expand_braces(suffix)
+                    return [prefix + ex + sx for item in items for ex in self.expand_braces(item) for sx in suffixes]
+            start = s.find('{', start + 1)
+        return [s]
+
+    def glob(self, pathname):
+        """ Return the paths matching a pathname with wildcards like glob.glob().
+        Directory listings are cached for the current pipe sequence and the
+        compiled patterns are cached as well.
+
+        :param pathname: the pathname to match
+        :type pathname: str
+        :return: the matching paths
+        :rtype: list of str
+        """
+        dirname, basename = os.path.split(pathname)
+        if not _GLOB_MAGIC_RE.search(pathname):
+            if basename:
+                return [pathname] if os.path.lexists(pathname) else []
+            else:
+                return [pathname] if os.path.isdir(dirname) else []
+        if not dirname:
+            return self._glob_in_dir(dirname, basename)
+        if dirname != pathname and _GLOB_MAGIC_RE.search(dirname):
+            dirs = self.glob(dirname)
+        else:
+            dirs = [dirname]
+        paths = []
+        for dirname in dirs:
+            if _GLOB_MAGIC_RE.search(basename):
+                names = self._glob_in_dir(dirname, basename)
+            elif basename:
+                names = [basename] if os.path.lexists(os.path.join(dirname, basename)) else []
+            else:
+                names = [basename] if os.path.isdir(dirname) else []
+            paths.extend(os.path.join(dirname, name) for name in names)
+        return paths
+
+    def _glob_in_dir(self, dirname, pattern):
+        """ Return the names in a directory matching a pattern.
+        Hidden names only match a pattern starting with a dot.
+        """
+        dirname = os.path.abspath(dirname or os.curdir)
+        cache = getattr(self._local, 'listdir_cache', None)
+        if cache is None:
+            cache = self._local.listdir_cache = {}
+        names = cache.get(dirname)
+        if names is None:
+            try:
+                names = os.listdir(dirname)
+            except OSError:
+                names = []
+            cache[dirname] = names
+        if not pattern.startswith('.'):
+            names = [name for name in names if not name.startswith('.')]
+
+        match = self.fnmatch_cache.get(pattern)
+        if match is None:
+            match = re.compile(fnmatch.translate(os.path.normcase(pattern))).match
+            self.fnmatch_cache.put(pattern, match)
+        return [name for name in names if match(os.path.normcase(name))]
+
     def expand_escaped(self, tok):
         if self.debug:
             self.logger.debug(tok)
@@ -612,90 +1165,72 @@ class ShExpander(object):
         if self.debug:
             self.logger.debug(s)
 
+        # Command substitution is done by bq_word_action
+        # Pathname expansion (glob) is done in word_action
+        if not s.startswith('~'):
+            return s
+        i = s.find('/', 1)
+        if i < 0:
+            i = len(s)
+        if i > 1:  # ~user
+            return os.path.expanduser(s)
         _, current_state = self.stash.runtime.get_current_worker_and_state()
-        saved_environ = os.environ
-        try:
-            os.environ = current_state.environ
-            s = os.path.expanduser(s)
-            # Command substitution is done by bq_word_action
-            # Pathname expansion (glob) is done in word_action
-        finally:
-            os.environ = saved_environ
-        return s
+        home = current_state.environ.get('HOME')
+        if home is None:
+            return os.path.expanduser(s)
+        return (home.rstrip('/') + s[i:]) or '/'
 
     def expandvars(self, s):
+        """ Expand the variables and parameter expansions in a string.
+        Supported are $NAME, ${NAME}, the special parameters $?, $#, $@, $$
+        and the positional parameters $0 to $9 as well as
+        ${#NAME} (length), ${NAME:-word}, ${NAME-word}, ${NAME:=word},
+        ${NAME=word}, ${NAME:+word}, ${NAME+word}, ${NAME#pattern},
+        ${NAME##pattern}, ${NAME%pattern} and ${NAME%%pattern}.
+        Variables are read from the environ of the current worker.
+        """
         if self.debug:
             self.logger.debug(s)
 
-        _, current_state = self.stash.runtime.get_current_worker_and_state()
-        saved_environ = os.environ
-        try:
-            os.environ = current_state.environ
-
-            state = 'a'
-            es = ''
-            varname = ''
-            for nextchar in s:
-
-                if state == 'a':
-                    if nextchar == '$':
-                        state = '$'
-                        varname = ''
-                    else:
-                        es += nextchar
-
-                elif state == '$':
-                    if varname == '':
-                        if nextchar == '{':
-                            state = '{'
-                        elif nextchar in '0123456789@#?':
-                            es += str(os.environ.get(nextchar, ''))
-                            state = 'a'
-                        elif nextchar == '$':
-                            es += str(threading.currentThread()._Thread__ident)
-                            state = 'a'
-                        elif nextchar in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz':
-                            varname += nextchar
-                        else:
-                            es += '$' + nextchar
-                            state = 'a'
-
-                    else:
-                        if nextchar in '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz':
-                            varname += nextchar
-                        else:
-                            if self.debug:
-                                self.logger.debug('environ sub: %s\n' % varname)
-                            es += os.environ.get(varname, '') + nextchar
-                            state = 'a'
-
-                elif state == '{':
-                    if nextchar == '}':
-                        if varname == '':
-                            raise ShBadSubstitution('bad environ substitution')
-                        else:
-                            es += os.environ.get(varname, '')
-                            state = 'a'
-                    elif nextchar in '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz':
-                        varname += nextchar
-                    else:
-                        raise ShBadSubstitution('bad environ substitution')
-
-                else:
-                    raise ShInternalError('syntax error in environ substitution')
+        if '$' not in s:
+            return s
 
-            if state == '$':
-                if varname != '':
-                    if self.debug:
-                        self.logger.debug('environ sub: %s\n' % varname)
-                    es += os.environ.get(varname, '')
-                else:
-                    es += '$'
-            elif state == '{':
-                raise ShBadSubstitution('bad environ substitution')
-
-        finally:
-            os.environ = saved_environ
+        _, current_state = self.stash.runtime.get_current_worker_and_state()
+        environ = current_state.environ
+
+        es = []
+        pos = 0
+        for m in _VAR_RE.finditer(s):
+            if m.start() < pos:  # inside a ${...} handled before
+                continue
+            es.append(s[pos:m.start()])
+            special, name = m.group(1, 2)
+            if special == '$':
+                es.append(str(threading.current_thread().ident))
+            elif special is not None:
+                es.append(str(environ.get(special, '')))
+            elif name is not None:
+                if self.debug:
+                    self.logger.debug('environ sub: %s\n' % name)
+                es.append(str(environ.get(name, '')))
+            else:
+                # ${...}, possibly with nested braces
+                depth = 0
+                for end in range(m.end() - 1, len(s)):
+                    if s[end] == '{':
+                        depth += 1
+                    elif s[end] == '}':
+                        depth -= 1
+                        if depth == 0:
+                            break
+                if depth != 0:
+                    raise ShBadSubstitution('bad environ substitution')
+                es.append(self.expand_parameter(s[m.end():end], environ))
+                pos = end + 1
+                continue
+            pos = m.end()
+        es.append(s[pos:])
+        es = ''.join(es)
 
         if s != es:
             if self.debug:
@@ -703,6 +1238,57 @@ class ShExpander(object):
 
         return es
 
+    def expand_parameter(self, expr, environ):
+        """ Expand the expression inside ${...}.
+
+        :param expr: the expression between the braces
+        :type expr: str
+        :param environ: the environ to read from and assign to
+        :return: the expanded value
+        :rtype: str
+        """
+        m = _PARAMETER_RE.match(expr)
+        if m is None:
+            raise ShBadSubstitution('bad environ substitution')
+        length, name, op, word = m.groups()
+        if self.debug:
+            self.logger.debug('environ sub: %s\n' % name)
+        value = environ.get(name, None)
+        if value is not None:
+            value = str(value)
+
+        if length:
+            if op is not None:
+                raise ShBadSubstitution('bad environ substitution')
+            return str(len(value or ''))
+        elif op is None:
+            return value or ''
+
+        word = self.expandvars(word)
+        if op in (':-', '-'):
+            if value is None or (op == ':-' and value == ''):
+                return word
+        elif op in (':=', '='):
+            if value is None or (op == ':=' and value == ''):
+                environ[name] = value = word
+        elif op in (':+', '+'):
+            if value is None or (op == ':+' and value == ''):
+                return ''
+            return word
+        elif value is not None:
+            # remove the shortest or longest matching prefix or suffix
+            if op in ('#', '%'):
+                lengths = range(len(value) + 1)
+            else:
+                lengths = range(len(value), -1, -1)
+            for n in lengths:
+                if op.startswith('#'):
+                    if fnmatch.fnmatchcase(value[:n], word):
+                        return value[n:]
+                elif fnmatch.fnmatchcase(value[len(value) - n:], word):
+                    return value[:len(value) - n]
+        return value or ''
+
     def escape_wildcards(self, s0):
         return ''.join(('[%s]' % c if c in '[]?*' else c) for c in s0)
 
@@ -8,6 +8,7 @@ import threading
 import functools
 import traceback
 import tempfile
+import time
 
 from six import StringIO, text_type, binary_type, PY3
 try:
@@ -15,8 +16,6 @@ try:
 except NameError:
     from io import IOBase as file
 
-import pyparsing as pp
-
 # Detecting environments
 try:
     from objc_util import on_main_thread
@@ -24,12 +23,13 @@ except ImportError:
     from .dummyobjc_util import on_main_thread
 
 from .shcommon import ShBadSubstitution, ShInternalError, ShIsDirectory, \
-    ShFileNotFound, ShEventNotFound, ShNotExecutable
+    ShFileNotFound, ShEventNotFound, ShNotExecutable, ShParseError, ShLRUCache
 # noinspection PyProtectedMember
 from .shcommon import _STASH_ROOT, _STASH_HISTORY_FILE, _SYS_STDOUT, _SYS_STDERR
 from .shcommon import is_binary_file, _STASH_EXTENSION_BIN_PATH
 from .shparsers import ShPipeSequence
-from .shthreads import ShBaseThread, ShTracedThread, ShCtypesThread, ShState, ShWorkerRegistry
+from .shthreads import ShBaseThread, ShTracedThread, ShCtypesThread, ShCooperativeThread, ShState, ShWorkerRegistry, \
+    ShLayeredDict, cancellable_sleep, check_cancelled
 from .shhistory import ShHistory
 
 # Default .stashrc file
@@ -59,6 +59,8 @@ class ShRuntime(object):
         self.expander = expander
         self.debug = debug
         self.logger = logging.getLogger('StaSh.Runtime')
+        # Compiled shell scripts keyed by path and mtime, see compile_sh_file()
+        self.script_cache = ShLRUCache(64)
 
         self.state = ShState(
             environ=dict(
@@ -90,18 +92,19 @@ class ShRuntime(object):
         self.input_encoding_utf8 = config.getint('system', 'input_encoding_utf8')
         self.ShThread = {
             'traced': ShTracedThread,
-            'ctypes': ShCtypesThread
+            'ctypes': ShCtypesThread,
+            'cooperative': ShCooperativeThread,
         }.get(config.get('system',
                          'thread_type'),
               ShCtypesThread)
+        if self.ShThread.cooperative:
+            # let cooperative workers end while they sleep
+            time.sleep = cancellable_sleep
         self.colored_errors = config.getboolean("style", "colored_errors")
 
-        # load history from last session
+        # load history from last session (in the background, awaited on first use)
         if not no_historyfile:
-            try:
-                self.history = ShHistory.load(self.historyfile, self.stash)
-            except IOError:
-                self.history = ShHistory(self.stash)
+            self.history = ShHistory.load_in_background(self.historyfile, self.stash)
         else:
             self.history = ShHistory(self.stash)
         self.history.swap("StaSh.runtime")
@@ -246,102 +249,21 @@ class ShRuntime(object):
                     else:
                         lines = input_.splitlines()
 
-                    for line in lines:
-                        # Ignore empty lines
-                        if line.strip() == '':
-                            continue
-
-                        # Parse and expand the line (note this function returns a generator object)
-                        expanded = self.expander.expand(line)
-                        # The first member is the history expanded form and number of pipe_sequence
-                        newline, n_pipe_sequences = next(expanded)
-                        # Only add history entry if:
-                        #   1. It is explicitly required
-                        #   2. It is the first layer thread directly spawned by the main thread
-                        #      and not explicitly required to not add
-                        if (add_to_history is None and is_top) or add_to_history:
-                            self.history.add(line)  # add non-expanded form to history
-
-                        if is_top:
-                            self.history.swap(newline.split(" ")[0] if newline != "" else "")
-
-                        try:
-                            # Subsequent members are actual commands
-                            for _ in range(n_pipe_sequences):
-                                pipe_sequence = next(expanded)
-                                if pipe_sequence.in_background:
-                                    # For background command, separate worker is created
-                                    self.run(
-                                        pipe_sequence,
-                                        final_ins=final_ins,
-                                        final_outs=final_outs,
-                                        final_errs=final_errs,
-                                        persistent_level=0,
-                                        is_background=True,
-                                        environ=environ,
-                                        cwd=cwd
-                                    )
-                                else:
-                                    self.run_pipe_sequence(
-                                        pipe_sequence,
-                                        final_ins=final_ins,
-                                        final_outs=final_outs,
-                                        final_errs=final_errs,
-                                        environ=environ,
-                                        cwd=cwd
-                                    )
-                        finally:
-                            if is_top:
-                                self.history.swap("StaSh.runtime")
-
-            except pp.ParseException as e:
-                if self.debug:
-                    self.logger.debug('ParseException: %s\n' % repr(e))
-                msg = 'syntax error: at char %d: %s\n' % (e.loc, e.pstr)
-                self.write_error_message(final_errs, msg)
-
-            except ShEventNotFound as e:
-                if self.debug:
-                    self.logger.debug('%s\n' % repr(e))
-                msg = '%s: event not found\n' % e.args[0]
-                self.write_error_message(final_errs, msg)
-
-            except ShBadSubstitution as e:
-                if self.debug:
-                    self.logger.debug('%s\n' % repr(e))
-                msg = '%s\n' % e.args[0]
-                self.write_error_message(final_errs, msg)
+                    self.exec_lines(
+                        [(line, None) for line in lines],
+                        final_ins=final_ins,
+                        final_outs=final_outs,
+                        final_errs=final_errs,
+                        add_to_history=add_to_history,
+                        is_top=is_top,
+                        environ=environ,
+                        cwd=cwd
+                    )
 
-            except ShInternalError as e:
-                if self.debug:
-                    self.logger.debug('%s\n' % repr(e))
-                msg = '%s\n' % e.args[0]
-                self.write_error_message(final_errs, msg)
-
-            except IOError as e:
-                if self.debug:
-                    self.logger.debug('IOError: %s\n' % repr(e))
-                msg = '%s: %s\n' % (e.filename, e.strerror)
-                self.write_error_message(final_errs, msg)
-
-            except KeyboardInterrupt as e:
-                msg = '^C\nKeyboardInterrupt: %s\n' % e.args[0]
-                self.write_error_message(final_errs, msg)
-
-            # This catch all exception handler is to handle errors outside of
-            # run_pipe_sequence. The traceback print is mainly for debugging
-            # the shell itself as opposed to the running script (handled inside
-            # exec_py_file)
-            except Exception as e:
-                etype, evalue, tb = sys.exc_info()
-                if self.debug:
-                    self.logger.debug('Exception: %s\n' % repr(e))
-                msg = '%s\n' % repr(e)
-                self.write_error_message(final_errs, msg)
-                if self.py_traceback or self.py_pdb:
-                    # traceback.print_exception(etype, evalue, tb, file=(final_errs if final_errs is not None else None))
-                    lines = traceback.format_exception(etype, evalue, tb)
-                    self.write_error_message(self.stash.text_color("".join(lines), "red"), prefix="")
+            # Errors outside of run_pipe_sequence, e.g. syntax errors, end the
+            # execution of the remaining lines.
+            except (Exception, KeyboardInterrupt) as e:
+                self.report_error(e, final_errs)
 
             finally:
                 # Housekeeping for the thread, e.g. remove itself from registry
@@ -378,6 +300,131 @@ class ShRuntime(object):
 
         return child_thread
 
+    def exec_lines(
+            self,
+            lines,
+            final_ins=None,
+            final_outs=None,
+            final_errs=None,
+            add_to_history=None,
+            is_top=False,
+            environ={},
+            cwd=None
+    ):
+        """
+        Run lines in the current worker thread.
+
+        :param lines: the lines to run as (line, template) pairs, where template
+                      is None or the result of parsing the line before. A
+                      template may also be the exception the parsing raised.
+        :type lines: list of (str, tuple or Exception)
+        :param final_ins:
+        :param final_outs:
+        :param final_errs:
+        :param add_to_history: whether to add the lines to history, None for top level only
+        :param is_top: whether the current worker is a top level worker
+        :param environ:
+        :param cwd:
+        """
+        for line, template in lines:
+            # Ignore empty lines
+            if line.strip() == '':
+                continue
+
+            if isinstance(template, Exception):
+                raise template
+
+            # Parse and expand the line (note this function returns a generator object)
+            expanded = self.expander.expand(line, template)
+            # The first member is the history expanded form and number of pipe_sequence
+            newline, n_pipe_sequences = next(expanded)
+            # Only add history entry if:
+            #   1. It is explicitly required
+            #   2. It is the first layer thread directly spawned by the main thread
+            #      and not explicitly required to not add
+            if (add_to_history is None and is_top) or add_to_history:
+                self.history.add(line)  # add non-expanded form to history
+
+            if is_top:
+                self.history.swap(newline.split(" ")[0] if newline != "" else "")
+
+            try:
+                # Subsequent members are actual commands
+                for _ in range(n_pipe_sequences):
+                    pipe_sequence = next(expanded)
+                    if pipe_sequence.in_background:
+                        # For background command, separate worker is created
+                        self.run(
+                            pipe_sequence,
+                            final_ins=final_ins,
+                            final_outs=final_outs,
+                            final_errs=final_errs,
+                            persistent_level=0,
+                            is_background=True,
+                            environ=environ,
+                            cwd=cwd
+                        )
+                    else:
+                        self.run_pipe_sequence(
+                            pipe_sequence,
+                            final_ins=final_ins,
+                            final_outs=final_outs,
+                            final_errs=final_errs,
+                            environ=environ,
+                            cwd=cwd
+                        )
+            finally:
+                if is_top:
+                    self.history.swap("StaSh.runtime")
+
+    def report_error(self, e, final_errs):
+        """
+        Write the error message for an exception which ended the execution of lines.
+        :param e: the exception
+        :type e: Exception
+        :param final_errs: file to write to or None
+        :type final_errs: file or None
+        """
+        if isinstance(e, ShParseError):
+            if self.debug:
+                self.logger.debug('ShParseError: %s\n' % repr(e))
+            msg = 'syntax error: at char %d: %s\n' % (e.loc, e.pstr)
+            self.write_error_message(final_errs, msg)
+
+        elif isinstance(e, ShEventNotFound):
+            if self.debug:
+                self.logger.debug('%s\n' % repr(e))
+            msg = '%s: event not found\n' % e.args[0]
+            self.write_error_message(final_errs, msg)
+
+        elif isinstance(e, (ShBadSubstitution, ShInternalError)):
+            if self.debug:
+                self.logger.debug('%s\n' % repr(e))
+            msg = '%s\n' % e.args[0]
+            self.write_error_message(final_errs, msg)
+
+        elif isinstance(e, IOError):
+            if self.debug:
+                self.logger.debug('IOError: %s\n' % repr(e))
+            msg = '%s: %s\n' % (e.filename, e.strerror)
+            self.write_error_message(final_errs, msg)
+
+        elif isinstance(e, KeyboardInterrupt):
+            msg = '^C\nKeyboardInterrupt: %s\n' % (e.args[0] if e.args else '')
+            self.write_error_message(final_errs, msg)
+
+        # The traceback print is mainly for debugging the shell itself as
+        # opposed to the running script (handled inside exec_py_file)
+        else:
+            etype, evalue, tb = sys.exc_info()
+            if self.debug:
+                self.logger.debug('Exception: %s\n' % repr(e))
+            msg = '%s\n' % repr(e)
+            self.write_error_message(final_errs, msg)
+            if self.py_traceback or self.py_pdb:
+                lines = traceback.format_exception(etype, evalue, tb)
+                self.write_error_message(self.stash.text_color("".join(lines), "red"), prefix="")
+
     def script_will_end(self):
         self.stash.io.write(self.get_prompt(), no_wait=True)
         # Config the mini buffer so that user commands can be processed
@@ -389,12 +436,13 @@ class ShRuntime(object):
         if self.debug:
             self.logger.debug(str(pipe_sequence))
 
-        _, current_state = self.get_current_worker_and_state()
+        current_worker, current_state = self.get_current_worker_and_state()
 
         n_simple_commands = len(pipe_sequence.lst)
 
         prev_outs = None
         for idx, simple_command in enumerate(pipe_sequence.lst):
+            check_cancelled()
 
             # The temporary_environ needs to be reset for each simple command
             # i.e. A=42 script1 | script2
@@ -416,6 +464,7 @@ class ShRuntime(object):
 
             outs = current_state.sys_stdout__
             errs = current_state.sys_stderr__
+            redirect_file = None  # a file opened for redirection, closed at the end
 
             if simple_command.io_redirect:
                 # Truncate file or append to file
@@ -426,7 +475,7 @@ class ShRuntime(object):
                     outs = _SYS_STDOUT
                     errs = _SYS_STDERR
                 else:
-                    errs = outs = open(simple_command.io_redirect.filename, mode)
+                    errs = outs = redirect_file = open(simple_command.io_redirect.filename, mode)
 
             elif idx < n_simple_commands - 1:  # before the last piped command
                 outs = StringIO()
@@ -470,7 +519,9 @@ class ShRuntime(object):
                 if current_state.return_value != 0:
                     break  # break out of the pipe_sequence, but NOT pipe_sequence list
 
-                if isinstance(outs, StringIO):
+                if idx < n_simple_commands - 1 and isinstance(outs, StringIO):
+                    if current_worker is not None:
+                        current_worker.stats.pipe_buffered(outs.tell())
                     outs.seek(0)  # rewind for next command in the pipe sequence
 
                 prev_outs = outs
@@ -496,9 +547,9 @@ class ShRuntime(object):
                 break  # break out of the pipe_sequence, but NOT pipe_sequence list
 
             finally:
-                if isinstance(outs, file) and not isinstance(outs, StringIO):
-                    # StringIO is subclass of IOBase in py3 but not in py2
-                    outs.close()
+                # Only close what was opened here, not the final_outs of the caller
+                if redirect_file is not None:
+                    redirect_file.close()
                 if isinstance(ins, StringIO):  # release the string buffer
                     ins.close()
 
@@ -528,9 +579,9 @@ class ShRuntime(object):
         argv = self.encode_argv(argv)
         sys.argv = argv
 
-        # Set current os environ to the threading environ
+        # Set current os environ to a copy-on-write copy of the threading environ
         saved_os_environ = os.environ
-        os.environ = dict(current_state.environ)
+        os.environ = ShLayeredDict(current_state.environ)
         # Honor any leading vars, e.g. A=42 echo $A
         os.environ.update(current_state.temporary_environ)
 
@@ -572,9 +623,40 @@ class ShRuntime(object):
             sys.path = saved_sys_path
             os.environ = saved_os_environ
 
+    def compile_sh_file(self, filename):
+        """
+        Parse a shell script into a list of line templates for exec_lines().
+        Variables, aliases etc. are still expanded when the lines are run.
+        The result is cached until the file is modified.
+        :param filename: path of the script
+        :type filename: str
+        :return: the compiled script
+        :rtype: list of (str, tuple or Exception)
+        """
+        path = os.path.abspath(filename)
+        key = (path, os.stat(path).st_mtime)
+        script = self.script_cache.get(key)
+        if script is None:
+            if self.debug:
+                self.logger.debug('compiling %s\n' % path)
+            script = []
+            # read the file in textmode.
+            with io.open(path, "r", newline=None) as fins:
+                for line in fins:
+                    if line.strip() == '':
+                        continue
+                    try:
+                        script.append((line, self.parser.parse(line)))
+                    except ShParseError as e:
+                        # Reported when the line is reached, nothing after it runs
+                        script.append((line, e))
+                        break
+            self.script_cache.put(key, script)
+        return script
+
     def exec_sh_file(self, filename, args=None, ins=None, outs=None, errs=None, add_to_history=None):
 
-        _, current_state = self.get_current_worker_and_state()
+        current_worker, current_state = self.get_current_worker_and_state()
 
         if args is None:
             args = []
@@ -585,32 +667,35 @@ class ShRuntime(object):
         current_state.temporary_environ['#'] = len(args)
         current_state.temporary_environ['@'] = '\t'.join(args)
 
-        # Enclosing variables will be merged to environ when creating new thread
         try:
-            # read the file in textmode.
-            with io.open(filename, "r", newline=None) as fins:
-                child_worker = self.run(
-                    fins.readlines(),
-                    final_ins=ins,
-                    final_outs=outs,
-                    final_errs=errs,
-                    add_to_history=add_to_history,
-                    add_new_inp_line=False,
-                    persistent_level=0
-                )
-                child_worker.join()
-
-            current_state.return_value = child_worker.state.return_value
-
+            script = self.compile_sh_file(filename)
         except IOError as e:
             emsg = '%s: %s\n' % (e.filename, e.strerror)
             self.write_error_message(errs, emsg)
             current_state.return_value = 1
+            return
+
+        # The script runs in the current worker with the state a child worker
+        # would have, i.e. enclosing variables are merged into its environ.
+        if current_worker is None:
+            current_worker = self
+        script_state = ShState.new_from_parent(current_state)
+        current_worker.state = script_state
+        try:
+            self.exec_lines(
+                script,
+                final_ins=ins,
+                final_outs=outs,
+                final_errs=errs,
+                add_to_history=add_to_history,
+            )
+        except Exception as e:
+            self.report_error(e, errs)
+        finally:
+            current_worker.state = current_state
+            current_state.persist_child(script_state, persistent_level=0)
 
-        except:
-            emsg = '%s: error while executing shell script\n' % filename
-            self.write_error_message(errs, emsg)
-            current_state.return_value = 2
+        current_state.return_value = script_state.return_value
 
     def encode_argv(self, argv):
         """
@@ -4,12 +4,21 @@ Killable threads
 """
 import os
 import sys
+import time
 import threading
 import weakref
 import ctypes
+import logging
+import itertools
 from collections import OrderedDict
 
 from .shcommon import M_64, _SYS_STDOUT, python_capi
+from .shiowrapper import bind as bind_thread_io, thread_io
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 _STATE_STR_TEMPLATE = """enclosed_cwd: {}
 aliases: {}
@@ -21,6 +30,133 @@ environ: {}
 """
 
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+# Marks a key deleted in a write layer while it is still present in a lower layer
+_DELETED = object()
+
+
+class ShLayeredDict(MutableMapping):
+    """ A copy-on-write mapping for the environ and aliases of a worker.
+    Changes go to a write layer on top of a chain of shared, read-only layers.
+    Creating a copy freezes the write layer into the chain, so it is O(1),
+    and each copy only stores the keys it modifies. Once the chain gets longer
+    than MAX_LAYERS, it is flattened into a single layer.
+
+    :param data: initial content; the content of another ShLayeredDict is shared
+    :type data: dict or ShLayeredDict
+    """
+
+    MAX_LAYERS = 8
+
+    def __init__(self, data=None):
+        if isinstance(data, ShLayeredDict):
+            self._layers = data._freeze()
+            self._write = {}
+        else:
+            self._layers = ()
+            self._write = dict(data or {})
+
+    def _freeze(self):
+        """ Move the write layer into the read-only layers and return them
+        """
+        if self._write:
+            layers = (self._write, ) + self._layers
+            if len(layers) > self.MAX_LAYERS:
+                layers = (dict(self._iteritems(layers)), )
+            self._layers = layers
+            self._write = {}
+        return self._layers
+
+    @staticmethod
+    def _iteritems(layers):
+        seen = set()
+        for layer in layers:
+            for key, value in layer.items():
+                if key not in seen:
+                    seen.add(key)
+                    if value is not _DELETED:
+                        yield key, value
+
+    def __getitem__(self, key):
+        value = self._write.get(key, _DELETED)
+        if value is _DELETED and key not in self._write:
+            for layer in self._layers:
+                if key in layer:
+                    value = layer[key]
+                    break
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, key, value):
+        self._write[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if any(key in layer for layer in self._layers):
+            self._write[key] = _DELETED
+        else:
+            del self._write[key]
+
+    def __iter__(self):
+        for key, _ in self._iteritems((self._write, ) + self._layers):
+            yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        """ Return a copy-on-write copy in O(1)
+        """
+        return self.__class__(self)
+
+
+# Source of alias table versions, shared by all tables
+_ALIAS_VERSIONS = itertools.count(1)
+
+
+class ShAliases(ShLayeredDict):
+    """ The alias table of a worker.
+    Each modification assigns a new, globally unique version. Two tables with
+    the same version have the same content, which allows caching the results
+    of alias substitution per version.
+    """
+
+    def __init__(self, data=None):
+        super(ShAliases, self).__init__(data)
+        if isinstance(data, ShAliases):
+            self.version = data.version  # a copy has the same content
+        else:
+            self.version = next(_ALIAS_VERSIONS)
+
+    def _modified(self):
+        self.version = next(_ALIAS_VERSIONS)
+
+    # The other modifying methods of MutableMapping are based on these
+    def __setitem__(self, key, value):
+        super(ShAliases, self).__setitem__(key, value)
+        self._modified()
+
+    def __delitem__(self, key):
+        super(ShAliases, self).__delitem__(key)
+        self._modified()
+
+
 class ShState(object):
     """ State of the current worker thread
     """
@@ -36,13 +172,13 @@ class ShState(object):
             sys_path=None
     ):
 
-        self.aliases = aliases or {}
-        self.environ = environ or {}
+        self.aliases = aliases if isinstance(aliases, ShAliases) else ShAliases(aliases)
+        self.environ = environ if isinstance(environ, ShLayeredDict) else ShLayeredDict(environ)
         self.enclosed_cwd = enclosed_cwd
 
-        self.sys_stdin__ = self.sys_stdin = sys_stdin or sys.stdin
-        self.sys_stdout__ = self.sys_stdout = sys_stdout or sys.stdout
-        self.sys_stderr__ = self.sys_stderr = sys_stderr or sys.stderr
+        self.sys_stdin__ = self._sys_stdin = sys_stdin or sys.stdin
+        self.sys_stdout__ = self._sys_stdout = sys_stdout or sys.stdout
+        self.sys_stderr__ = self._sys_stderr = sys_stderr or sys.stderr
         self.sys_path = sys_path or sys.path[:]
 
         self.temporary_environ = {}
@@ -63,6 +199,40 @@ class ShState(object):
         )
         return s
 
+    # The wrappers of sys.stdin etc. cache the streams of the current worker,
+    # so changes need to be passed on. See shiowrapper.bind().
+    def _streams_changed(self):
+        worker = thread_io.worker
+        if worker is not None and worker.state is self:
+            bind_thread_io(worker)
+
+    @property
+    def sys_stdin(self):
+        return self._sys_stdin
+
+    @sys_stdin.setter
+    def sys_stdin(self, value):
+        self._sys_stdin = value
+        self._streams_changed()
+
+    @property
+    def sys_stdout(self):
+        return self._sys_stdout
+
+    @sys_stdout.setter
+    def sys_stdout(self, value):
+        self._sys_stdout = value
+        self._streams_changed()
+
+    @property
+    def sys_stderr(self):
+        return self._sys_stderr
+
+    @sys_stderr.setter
+    def sys_stderr(self, value):
+        self._sys_stderr = value
+        self._streams_changed()
+
     @property
     def return_value(self):
         return self.environ.get('?', 0)
@@ -90,10 +260,10 @@ class ShState(object):
 
         elif persistent_level == 1:
             # update state
-            self.aliases = dict(child_state.aliases)
+            self.aliases = ShAliases(child_state.aliases)
             self.enclosing_aliases = child_state.aliases
             self.enclosed_cwd = self.enclosing_cwd = os.getcwd()
-            self.environ = dict(child_state.environ)
+            self.environ = ShLayeredDict(child_state.environ)
             self.enclosing_environ = child_state.environ
             self.sys_path = child_state.sys_path[:]
 
@@ -118,12 +288,12 @@ class ShState(object):
         if parent_state.enclosing_aliases:
             aliases = parent_state.enclosing_aliases
         else:
-            aliases = dict(parent_state.aliases)
+            aliases = ShAliases(parent_state.aliases)
 
         if parent_state.enclosing_environ:
             environ = parent_state.enclosing_environ
         else:
-            environ = dict(parent_state.environ)
+            environ = ShLayeredDict(parent_state.environ)
             environ.update(parent_state.temporary_environ)
 
         if parent_state.enclosing_cwd:
@@ -140,6 +310,181 @@ class ShState(object):
         )
 
 
+class ShCancellationToken(object):
+    """ The request to cancel a worker.
+    A cooperative worker checks its token at cheap points, e.g. when it reads
+    or writes, and raises KeyboardInterrupt once the token is cancelled.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._event = threading.Event()
+
+    def cancel(self):
+        self.cancelled = True
+        self._event.set()
+
+    def check(self):
+        """
+        Raise KeyboardInterrupt if the token is cancelled.
+        """
+        if self.cancelled:
+            raise KeyboardInterrupt()
+
+    def wait(self, timeout):
+        """
+        Wait until the token is cancelled or the timeout expired.
+        :param timeout: the timeout in seconds
+        :type timeout: float
+        :return: whether the token is cancelled
+        :rtype: bool
+        """
+        return self._event.wait(timeout)
+
+
+def check_cancelled():
+    """
+    Raise KeyboardInterrupt if the cancellation of the worker running in the
+    current thread was requested. This is cheap enough to be called often.
+    """
+    worker = thread_io.worker
+    if worker is not None and worker.cancel_token.cancelled:
+        raise KeyboardInterrupt()
+
+
+_time_sleep = time.sleep
+
+
+def cancellable_sleep(seconds):
+    """
+    A replacement for time.sleep() which returns early with KeyboardInterrupt
+    when a cooperative worker is cancelled. See ShCooperativeThread.
+    :param seconds: the time to sleep
+    :type seconds: float
+    """
+    worker = thread_io.worker
+    if worker is None or not worker.cooperative:
+        return _time_sleep(seconds)
+    if worker.cancel_token.wait(seconds):
+        raise KeyboardInterrupt()
+
+
+def thread_cpu_times():
+    """
+    Return the CPU time the current thread spent in user and system mode.
+    Where the two cannot be told apart, the total is reported as user time.
+    :return: (user, system) in seconds or None if not available
+    :rtype: tuple of (float, float) or None
+    """
+    if resource is not None and hasattr(resource, 'RUSAGE_THREAD'):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime, usage.ru_stime
+    elif hasattr(time, 'thread_time'):
+        return time.thread_time(), 0.0
+    else:
+        return None
+
+
+class ShJobStats(object):
+    """ Resource usage of a worker thread.
+    The sizes of stdout and stderr are the lengths of the written strings, i.e.
+    characters for text and bytes for binary data. The peak pipe size is the
+    largest output buffered for the next command of a pipe sequence.
+    """
+
+    def __init__(self):
+        self.start_time = None
+        self.end_time = None
+        self.ident = None
+        self.user_time = None
+        self.sys_time = None
+        self._start_cpu_times = None
+        self.stdout_size = 0
+        self.stderr_size = 0
+        self.stdin_lines = 0
+        self.peak_pipe_size = 0
+
+    def __repr__(self):
+        return 'real {}  cpu {}  out {}  err {}  in {}  pipe {}'.format(
+            format_seconds(self.wall_time),
+            format_seconds(self.cpu_time),
+            self.stdout_size,
+            self.stderr_size,
+            self.stdin_lines,
+            self.peak_pipe_size
+        )
+
+    def started(self):
+        """
+        Record the start of the worker. Must be called from the worker thread.
+        """
+        self.ident = threading.current_thread().ident
+        self._start_cpu_times = thread_cpu_times()
+        self.start_time = time.time()
+
+    def stopped(self):
+        """
+        Record the end of the worker. Must be called from the worker thread.
+        """
+        self.end_time = time.time()
+        cpu_times = thread_cpu_times()
+        if cpu_times is not None and self._start_cpu_times is not None:
+            self.user_time = cpu_times[0] - self._start_cpu_times[0]
+            self.sys_time = cpu_times[1] - self._start_cpu_times[1]
+
+    @property
+    def wall_time(self):
+        """
+        The elapsed time in seconds, up to now for a running worker.
+        """
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def cpu_time(self):
+        """
+        The CPU time in seconds or None if not available. For a running worker,
+        the CPU time up to now is only available on some platforms.
+        """
+        if self.user_time is not None:
+            return self.user_time + self.sys_time
+        elif self.end_time is None and self.ident is not None:
+            if self.ident == threading.current_thread().ident:
+                cpu_times = thread_cpu_times()
+                if cpu_times is not None and self._start_cpu_times is not None:
+                    return sum(cpu_times) - sum(self._start_cpu_times)
+            elif hasattr(time, 'pthread_getcpuclockid'):
+                try:
+                    return time.clock_gettime(time.pthread_getcpuclockid(self.ident))
+                except (OSError, ValueError):
+                    pass
+        return None
+
+    def pipe_buffered(self, size):
+        """
+        Record the size of the output buffered between two piped commands.
+        :param size: the buffered size
+        :type size: int
+        """
+        if size > self.peak_pipe_size:
+            self.peak_pipe_size = size
+
+
+def format_seconds(seconds):
+    """
+    Format a duration like the time command of other shells, e.g. 0m1.250s.
+    :param seconds: the duration or None if not available
+    :type seconds: float or None
+    :return: the formatted duration
+    :rtype: str
+    """
+    if seconds is None:
+        return '?'
+    minutes, seconds = divmod(seconds, 60)
+    return '{:d}m{:.3f}s'.format(int(minutes), seconds)
+
+
 class ShWorkerRegistry(object):
     """ Bookkeeping for all worker threads (both foreground and background).
     This is useful to provide an overview of all running threads.
@@ -209,6 +554,9 @@ class ShBaseThread(threading.Thread):
     STARTED = 2
     STOPPED = 3
 
+    # Whether the thread ends at the check points of its cancel_token when killed
+    cooperative = False
+
     def __init__(self, registry, parent, command, target=None, is_background=False, environ={}, cwd=None):
         super(ShBaseThread, self).__init__(group=None, target=target, name='_shthread', args=(), kwargs=None)
 
@@ -235,6 +583,10 @@ class ShBaseThread(threading.Thread):
         self.killed = False
         self.killer = 0
         self.child_thread = None
+        self.cancel_token = ShCancellationToken()
+
+        # Resource usage, see ShJobStats
+        self.stats = ShJobStats()
 
         self.set_background(is_background)
 
@@ -250,18 +602,36 @@ class ShBaseThread(threading.Thread):
             command_str[:20] + ('...' if len(command_str) > 20 else '')
         )
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, value):
+        self._state = value
+        if thread_io.worker is self:
+            bind_thread_io(self)
+
+    def run(self):
+        bind_thread_io(self)
+        self.stats.started()
+        try:
+            super(ShBaseThread, self).run()
+        finally:
+            self.stats.stopped()
+
     def status(self):
         """
         Status of the thread. Created, Started or Stopped.
         """
         # STATES
-        # isAlive() | self.ident  | Meaning
+        # is_alive()| self.ident  | Meaning
         # ----------+-------------+--------
         # False     |     None    | created
         # False     | not None    | stopped
         # True      |     None    | impossible
         # True      | not None    | running
-        if self.isAlive():
+        if self.is_alive():
             return self.STARTED
         elif (not self.is_alive()) and (self.ident is not None):
             return self.STOPPED
@@ -393,3 +763,84 @@ class ShCtypesThread(ShBaseThread):
                 self.killed = False
             else:
                 self.on_kill()
+
+
+class ShCooperativeThread(ShCtypesThread):
+    """
+    A thread class which is killed by cancelling its cancel_token. The thread
+    raises KeyboardInterrupt at the next check point, i.e. when it reads or
+    writes, between the commands of a pipe sequence, in time.sleep() and when it
+    runs a command with _stash(). As this costs nothing while the thread runs,
+    it is much faster than a ShTracedThread.
+
+    A thread which does not reach a check point in time, e.g. a CPU-bound loop,
+    gets the exception raised with ctypes after escalation_delay seconds. Only
+    if that fails, a trace function is installed in all threads which raises the
+    exception in this thread (python 3.12+).
+    """
+
+    cooperative = True
+    escalation_delay = 1.0
+
+    def __init__(self, registry, parent, command, target=None, is_background=False, environ={}, cwd=None):
+        super(ShCooperativeThread,
+              self).__init__(
+                  registry,
+                  parent,
+                  command,
+                  target=target,
+                  is_background=is_background,
+                  environ=environ,
+                  cwd=cwd
+              )
+        self.logger = logging.getLogger('StaSh.Threads')
+        self._traced = False
+
+    def run(self):
+        try:
+            super(ShCooperativeThread, self).run()
+        finally:
+            if self._traced:
+                threading.settrace_all_threads(None)
+
+    def kill(self):
+        if not self.killed:
+            self.killed = True
+            self.cancel_token.cancel()
+            if self.child_thread:
+                self.child_thread.kill()
+            self.on_kill()
+            timer = threading.Timer(self.escalation_delay, self._escalate)
+            timer.daemon = True
+            timer.start()
+
+    def _escalate(self):
+        """
+        Raise the exception in the thread if it did not end in time.
+        """
+        if not self.is_alive():
+            return
+        try:
+            self._async_raise()
+        except (ValueError, SystemError, AttributeError):
+            if hasattr(threading, 'settrace_all_threads'):
+                self._install_trace()
+            else:
+                self.logger.warning('cannot terminate job {}'.format(self.job_id))
+
+    def _install_trace(self):
+        raised = []
+
+        def trace(frame, why, arg):
+            if not raised and threading.current_thread() is self:
+                raised.append(True)
+                raise KeyboardInterrupt()
+            return None
+
+        self._traced = True
+        threading.settrace_all_threads(trace)
+        # the frames already running only see the trace as their local trace
+        frame = sys._current_frames().get(self.ident)
+        while frame is not None:
+            frame.f_trace = trace
+            frame = frame.f_back
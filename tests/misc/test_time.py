@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""tests for the 'time' command and the resource usage of jobs."""
+import time
+
+from stash.tests.stashtest import StashTestCase
+
+
+class TimeTests(StashTestCase):
+    """tests for the 'time' command and the resource usage of jobs."""
+
+    setup_commands = ['BIN_PATH=$STASH_ROOT/tests/system/data:$BIN_PATH']
+
+    def test_help(self):
+        """test 'time --help'."""
+        output = self.run_command("time --help", exitcode=0)
+        self.assertIn("time", output)
+        self.assertIn("-v", output)
+
+    def test_time(self):
+        """test 'time echo test'."""
+        output = self.run_command("time -v echo test", exitcode=0)
+        self.assertTrue(output.startswith("test\n"))
+        for name in ("real", "user", "sys", "stdout", "stderr", "stdin", "pipe"):
+            self.assertIn("\n" + name + "\t", output)
+        self.assertIn("stdout\t5\n", output)
+
+    def test_exitcode(self):
+        """test that 'time' exits with the exitcode of the command."""
+        self.run_command("time exit 3", exitcode=3)
+
+    def test_worker_stats(self):
+        """test the stats of a worker"""
+        worker = self.stash("echo a b c | cat", final_outs=None)
+        stats = worker.stats
+        self.assertEqual(stats.stdout_size, 12)
+        self.assertEqual(stats.stdin_lines, 1)
+        self.assertEqual(stats.peak_pipe_size, 6)
+        self.assertGreaterEqual(stats.wall_time, 0.0)
+        self.assertIsNotNone(stats.end_time)
+        self.assertLessEqual(stats.cpu_time, stats.wall_time)
+
+    def test_jobs_long(self):
+        """test that 'jobs -l' shows the stats of a background job"""
+        self.stash("test_101_1.py &")
+        try:
+            time.sleep(0.5)
+            output = self.run_command("jobs -l", exitcode=0)
+            self.assertIn("test_101_1.py", output)
+            self.assertIn("real 0m", output)
+            self.assertIn("out 15", output)
+        finally:
+            time.sleep(2)
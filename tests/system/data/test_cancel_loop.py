@@ -0,0 +1,11 @@
+# coding=utf-8
+"""A loop which writes output or sleeps or does neither, depending on sys.argv[1]"""
+import sys
+import time
+
+mode = sys.argv[1]
+while True:
+    if mode == 'write':
+        sys.stdout.write('x')
+    elif mode == 'sleep':
+        time.sleep(30)
@@ -0,0 +1,16 @@
+# coding=utf-8
+"""Print to a stream set on the state of the worker while it runs"""
+from __future__ import print_function
+from six import StringIO
+
+_stash = globals()['_stash']
+
+worker, state = _stash.runtime.get_current_worker_and_state()
+saved_stdout = state.sys_stdout
+outs = StringIO()
+state.sys_stdout = outs
+try:
+    print('redirected')
+finally:
+    state.sys_stdout = saved_stdout
+print(outs.getvalue().strip())
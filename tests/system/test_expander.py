@@ -89,3 +89,99 @@ class ExpanderTests(StashTestCase):
         assert cmd.args[0] == '-1' and len(cmd.args) == 1
         assert cmd.io_redirect.operator == '>'
         assert cmd.io_redirect.filename == '&3'
+
+    def test_escaped_wildcards(self):
+        """test that escaped and quoted wildcards are not globbed"""
+        pipe_sequence = self._get_pipe_sequence(r'ls \* "*.md" R\?ADME.md')
+        assert pipe_sequence.lst[0].args == ['*', '*.md', 'R?ADME.md']
+
+        pipe_sequence = self._get_pipe_sequence(r"ls '[A-Z]*.md' \[A-Z\]*")
+        assert pipe_sequence.lst[0].args == ['[A-Z]*.md', '[A-Z]*']
+
+        # the escaped part is matched literally, the rest is globbed
+        pipe_sequence = self._get_pipe_sequence(r'ls README"."* "README".m?')
+        assert pipe_sequence.lst[0].args == ['README.md', 'README.md']
+
+        pipe_sequence = self._get_pipe_sequence(r'ls README\.md\*')
+        assert pipe_sequence.lst[0].args == ['README.md*']
+
+    def test_glob_fast_path(self):
+        """test that words without wildcards are not globbed"""
+        expander = self.stash.runtime.expander
+        globbed = []
+        glob = expander.glob
+        expander.glob = lambda pathname: globbed.append(pathname) or glob(pathname)
+        try:
+            pipe_sequence = self._get_pipe_sequence(r'ls -la install README.md \* "*" *.md')
+        finally:
+            del expander.glob
+        assert globbed == ['*.md']
+        assert pipe_sequence.lst[0].args[:5] == ['-la', 'install', 'README.md', '*', '*']
+        assert 'CHANGES.md' in pipe_sequence.lst[0].args[5:]
+
+    def test_glob_directories(self):
+        """test globbing in and of directories"""
+        pipe_sequence = self._get_pipe_sequence(r'ls tests/sys*/test_e*.py tests/system/ tests/nonexistent*/x')
+        assert pipe_sequence.lst[0].args == ['tests/system/test_expander.py', 'tests/system/', 'tests/nonexistent*/x']
+
+        pipe_sequence = self._get_pipe_sequence(r'ls tes?s/')
+        assert pipe_sequence.lst[0].args == ['tests/']
+
+    def test_brace_expansion(self):
+        """test that braces with a comma are expanded"""
+        pipe_sequence = self._get_pipe_sequence(r'echo a{b,c}d {x,y}{1,2} {a,{b,c}} {} {a} ${SELFUPDATE_TARGET} "{q,r}" \{s,t\}')
+        assert pipe_sequence.lst[0].args == [
+            'abd', 'acd', 'x1', 'x2', 'y1', 'y2', 'a', 'b', 'c', '{}', '{a}', 'master', '{q,r}', '{s,t}'
+        ]
+
+        pipe_sequence = self._get_pipe_sequence(r'ls {README,CHANGES}.m?')
+        assert pipe_sequence.lst[0].args == ['README.md', 'CHANGES.md']
+
+        # no brace expansion in assignments
+        pipe_sequence = self._get_pipe_sequence(r'A={a,b} echo')
+        assert pipe_sequence.lst[0].assignments[0].value == '{a,b}'
+
+    def test_variables(self):
+        """test the expansion of variables and special parameters"""
+        self.stash.runtime.state.environ.update(VA='foo', VB='')
+        cmd = self._get_pipe_sequence(r'echo $VA ${VA} "x${VA}y" $VAz $VB. $UNSET_VAR. $ $1a $?')
+        assert cmd.lst[0].args == ['foo', 'foo', 'xfooy', '', '.', '.', '$', 'a', '0']
+        cmd = self._get_pipe_sequence(r'echo $$')
+        assert cmd.lst[0].args[0].isdigit()
+        assert 'bad environ substitution' in self.run_command('echo ${}', exitcode=0)
+
+    def test_parameter_expansion(self):
+        """test the parameter expansions inside ${...}"""
+        self.stash.runtime.state.environ.update(VA='foo', VB='', VC='a_b.txt.bak')
+        cases = [
+            ('${#VA}', '3'),
+            ('${#UNSET_VAR}', '0'),
+            ('${VA:-d}', 'foo'),
+            ('${VB:-d}', 'd'),
+            ('${VB-d}.', '.'),
+            ('${UNSET_VAR-d}', 'd'),
+            ('${UNSET_VAR:-$VA}', 'foo'),
+            ('${UNSET_VAR:-${VA}x}', 'foox'),
+            ('${VA:+set}', 'set'),
+            ('${VB:+set}.', '.'),
+            ('${VB+set}', 'set'),
+            ('${VC%.*}', 'a_b.txt'),
+            ('${VC%%.*}', 'a_b'),
+            ('${VC#*_}', 'b.txt.bak'),
+            ('${VC##*.}', 'bak'),
+            ('${VC%nomatch}', 'a_b.txt.bak'),
+        ]
+        for expr, expected in cases:
+            cmd = self._get_pipe_sequence('echo ' + expr)
+            assert cmd.lst[0].args == [expected], expr
+        assert self.run_command('echo ${VASSIGN:=new} $VASSIGN', exitcode=0) == 'new new\n'
+        assert 'bad environ substitution' in self.run_command('echo ${VA', exitcode=0)
+        assert 'bad environ substitution' in self.run_command('echo ${VA!x}', exitcode=0)
+
+    def test_environ_not_swapped(self):
+        """test that expanding variables does not touch os.environ"""
+        environ = os.environ
+        self.stash.runtime.state.environ['VA'] = 'foo'
+        cmd = self._get_pipe_sequence('echo $VA ~')
+        assert os.environ is environ
+        assert cmd.lst[0].args[0] == 'foo'
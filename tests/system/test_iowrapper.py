@@ -0,0 +1,33 @@
+# coding=utf-8
+"""Tests for the dispatch of sys.stdin, sys.stdout and sys.stderr"""
+import threading
+
+from stash.system.shcommon import _SYS_STDERR, _SYS_STDOUT
+from stash.system.shiowrapper import stderrWrapper, stdoutWrapper, thread_io
+from stash.tests.stashtest import StashTestCase
+
+
+class IOWrapperTests(StashTestCase):
+    """Tests for the io wrappers"""
+
+    setup_commands = ['BIN_PATH=$STASH_ROOT/tests/system/data:$BIN_PATH']
+
+    def test_other_threads(self):
+        """test that threads which are not workers use the regular sys io"""
+        results = []
+
+        def f():
+            results.append((thread_io.worker, stdoutWrapper.write == _SYS_STDOUT.write, stderrWrapper.encoding))
+
+        t = threading.Thread(target=f)
+        t.start()
+        t.join()
+        self.assertEqual(results, [(None, True, getattr(_SYS_STDERR, 'encoding'))])
+
+    def test_worker(self):
+        """test that a worker writes to the streams of its state"""
+        self.assertEqual(self.run_command("echo test", exitcode=0), "test\n")
+
+    def test_streams_changed(self):
+        """test that changing a stream of the state takes effect at once"""
+        self.assertEqual(self.run_command("test_iowrapper.py", exitcode=0), "redirected\n")
@@ -0,0 +1,218 @@
+# coding=utf-8
+"""Tests for stash.system.shparsers.ShParser"""
+from stash.system.shcommon import ShLRUCache, ShParseError
+from stash.system.shparsers import ShParser, ShToken
+from stash.tests.stashtest import StashTestCase
+
+
+class ParserCacheTests(StashTestCase):
+    """Tests for the parse cache"""
+
+    def setUp(self):
+        StashTestCase.setUp(self)
+        self.parser = self.stash.runtime.parser
+        self.expander = self.stash.runtime.expander
+        self.parser.cache.clear()
+
+    def _get_pipe_sequence(self, line):
+        expanded = self.expander.expand(line)
+        next(expanded)
+        return next(expanded)
+
+    def test_lru_cache(self):
+        """test that the least recently used entry is discarded first"""
+        cache = ShLRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_cache_hit(self):
+        """test that parsing the same line twice is served from the cache"""
+        tokens1, parsed1 = self.parser.parse("echo a b | grep a")
+        tokens2, parsed2 = self.parser.parse("echo a b | grep a")
+        self.assertEqual(self.parser.cache.hits, 1)
+        self.assertIs(parsed1, parsed2)
+        self.assertEqual([t.tok for t in tokens1], [t.tok for t in tokens2])
+
+    def test_cached_tokens_are_copies(self):
+        """test that modifying returned tokens does not corrupt the cache"""
+        tokens, _ = self.parser.parse('A=1 echo "$A" x')
+        for t in tokens:
+            t.tok = "changed"
+            t.parts = None
+        tokens, _ = self.parser.parse('A=1 echo "$A" x')
+        self.assertEqual([t.tok for t in tokens], ['A=1', 'echo', '"$A"', 'x'])
+        self.assertEqual(tokens[0].parts.tok, '1')
+        self.assertEqual(tokens[2].parts[0].tok, '"$A"')
+
+    def test_expansion_does_not_corrupt_cache(self):
+        """test that history and alias substitution work on copies"""
+        self.stash("alias cachetest='echo cached'", persistent_level=1)
+        for _ in range(3):
+            pipe_sequence = self._get_pipe_sequence("cachetest x")
+            self.assertEqual(pipe_sequence.lst[0].cmd_word, "echo")
+            self.assertEqual(pipe_sequence.lst[0].args, ["cached", "x"])
+        tokens, _ = self.parser.parse("cachetest x")
+        self.assertEqual(tokens[0].tok, "cachetest")
+
+    def test_alias_change_invalidates_cache(self):
+        """test that redefining an alias is honored"""
+        self.stash("alias cachetest='echo first'", persistent_level=1)
+        pipe_sequence = self._get_pipe_sequence("cachetest")
+        self.assertEqual(pipe_sequence.lst[0].args, ["first"])
+        self.stash("alias cachetest='echo second'", persistent_level=1)
+        pipe_sequence = self._get_pipe_sequence("cachetest")
+        self.assertEqual(pipe_sequence.lst[0].args, ["second"])
+
+
+class NativeParserTests(StashTestCase):
+    """Tests comparing the native parser engine with the pyparsing engine"""
+
+    corpus = [
+        '',
+        '   ',
+        '# only a comment',
+        'ls',
+        'ls -la /tmp  # trailing comment',
+        'echo a b c',
+        'echo a;',
+        'echo a ; echo b & echo c',
+        'a | b | c & d ; e',
+        'cat file | grep -n "x y" | sort > out.txt',
+        'ls >> log',
+        'ls >log',
+        'A=1 B="2 3" echo $A $B',
+        'A=1',
+        'A=1 > f',
+        'A=1  ls',
+        'A=1 #c',
+        '!ls',
+        '!!',
+        '!-1',
+        '\\ls',
+        '\\x41',
+        'echo \\x414 \\01 \\033 \\1234 \\08 \\0',
+        'echo \\ a\\ b',
+        'echo "a $B \\"c\\"" \'s\\\'q\' `pwd`',
+        'echo a"b"c\'d\'#e',
+        'echo &3',
+        'ls a&3',
+        'ls &3',
+        'ls;&3',
+        'ls > f &3',
+        'ls\tx\ty',
+        'echo a\nb',
+        'echo $((1+2)) ${HOME} ~/x [a-z]* {a,b}',
+        # invalid lines
+        '|',
+        '; ls',
+        'ls |',
+        'a;;b',
+        'a&&b',
+        '> f',
+        'ls | > f',
+        'ls > f > g',
+        'A=1 ls > f x',
+        'echo "abc',
+        'echo \'abc',
+        'echo é',
+        'echo \\é',
+        'ls >',
+        'ls >>>',
+    ]
+
+    dq_corpus = [
+        'a b c',
+        '$HOME/x y',
+        '`pwd`/x',
+        'a\\"b\\\\c',
+        '\\x41\\101\\n',
+        'a\tb',
+        ' a ',
+        '',
+        'a`b',
+        'a\\',
+    ]
+
+    def setUp(self):
+        StashTestCase.setUp(self)
+        self.native = ShParser(engine='native')
+        self.pyparsing = ShParser(engine='pyparsing')
+
+    def _normalize_token(self, token):
+        """return a comparable representation of a token and its parts"""
+        if token is None:
+            return None
+        elif isinstance(token, ShToken):
+            return (token.tok, token.spos, token.epos, token.ttype, self._normalize_token(token.parts))
+        else:
+            return [self._normalize_token(t) for t in token]
+
+    def _normalize_parsed(self, parsed):
+        """return a comparable representation of the parse structure"""
+        ret = []
+        for pseq in parsed:
+            if isinstance(pseq, str):
+                ret.append(pseq)
+                continue
+            lst = []
+            for cmd in pseq:
+                if isinstance(cmd, str):
+                    lst.append(cmd)
+                else:
+                    lst.append((list(cmd.cmd_prefix), cmd.cmd_word, list(cmd.args), list(cmd.io_redirect), list(cmd)))
+            ret.append(lst)
+        return ret
+
+    def _parse(self, parser, line):
+        """parse a line and return a comparable result"""
+        try:
+            tokens, parsed = parser.parse(line)
+        except ShParseError as e:
+            return "error", e.loc
+        return self._normalize_token(tokens), self._normalize_parsed(parsed)
+
+    def _parse_within_dq(self, parser, s):
+        """parse the content of double quotes and return a comparable result"""
+        try:
+            parts, _ = parser.parse_within_dq(s)
+        except ShParseError:
+            return "error"
+        return self._normalize_token(parts)
+
+    def test_same_results(self):
+        """test that both engines produce the same tokens and parse structure"""
+        for line in self.corpus:
+            self.assertEqual(self._parse(self.native, line), self._parse(self.pyparsing, line), repr(line))
+
+    def test_same_results_within_dq(self):
+        """test that both engines produce the same parts inside double quotes"""
+        for s in self.dq_corpus:
+            self.assertEqual(self._parse_within_dq(self.native, s), self._parse_within_dq(self.pyparsing, s), repr(s))
+
+    def test_syntax_error(self):
+        """test that syntax errors are reported with their location"""
+        self.assertEqual(self._parse(self.native, "ls |"), ("error", 3))
+        output = self.run_command("echo a;;", exitcode=0)
+        self.assertIn("syntax error: at char 7", output)
+
+    def test_no_grammar_built(self):
+        """test that the default engine does not need the pyparsing grammar"""
+        parser = self.stash.runtime.parser
+        self.assertEqual(parser.engine, "native")
+        self.run_command("echo test | grep t", exitcode=0)
+        self.assertIsNone(parser.parser)
+
+    def test_modifier_not_in_parts(self):
+        """test that the modifier of a command word is not part of its parts"""
+        tokens, _ = self.native.parse("!ls -l")
+        self.assertEqual(tokens[0].tok, "!ls")
+        self.assertEqual([p.tok for p in tokens[0].parts], ["ls"])
@@ -1,4 +1,7 @@
 # coding=utf-8
+import os
+import shutil
+import tempfile
 
 from stash.tests.stashtest import StashTestCase
 
@@ -116,3 +119,70 @@ from child script 2 bin
 parent script stash
 [stash]$ """
         self.do_test('test_12.py', cmp_str)
+
+    def test_final_outs(self):
+        """
+        The output of several commands is appended to final_outs
+        """
+        self.assertEqual(self.run_command('echo 1; echo 2 | cat', exitcode=0), '1\n2\n')
+
+
+class ScriptTests(StashTestCase):
+    """Tests for the execution of compiled shell scripts"""
+
+    def setUp(self):
+        StashTestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, "script.sh")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        StashTestCase.tearDown(self)
+
+    def write_script(self, content, filename="script.sh"):
+        """write a file to the temporary directory and return its path"""
+        path = os.path.join(self.tmpdir, filename)
+        with open(path, "w") as fout:
+            fout.write(content)
+        return path
+
+    def test_compile_cache(self):
+        """test that a script is only compiled once"""
+        self.write_script("A=1\necho A is $A\n")
+        for _ in range(3):
+            output = self.run_command(self.script, exitcode=0)
+            self.assertEqual(output, "A is 1\n")
+        cache = self.stash.runtime.script_cache
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.hits, 2)
+
+    def test_recompile_after_change(self):
+        """test that a modified script is compiled again"""
+        self.write_script("echo first\n")
+        self.assertEqual(self.run_command(self.script, exitcode=0), "first\n")
+        self.write_script("echo second\n")
+        mtime = os.stat(self.script).st_mtime + 10
+        os.utime(self.script, (mtime, mtime))
+        self.assertEqual(self.run_command(self.script, exitcode=0), "second\n")
+
+    def test_deferred_expansion(self):
+        """test that variables are expanded when the line is run"""
+        self.write_script("echo $1$A\n")
+        self.assertEqual(self.run_command(self.script + " x", exitcode=0), "x\n")
+        self.assertEqual(self.run_command("A=2 " + self.script + " y", exitcode=0), "y2\n")
+
+    def test_syntax_error(self):
+        """test that a syntax error ends the script when it is reached"""
+        before = os.path.join(self.tmpdir, "before.txt")
+        after = os.path.join(self.tmpdir, "after.txt")
+        self.write_script("echo x > {}\necho a;;\necho x > {}\n".format(before, after))
+        output = self.run_command(self.script)
+        self.assertIn("syntax error", output)
+        self.assertTrue(os.path.exists(before))
+        self.assertFalse(os.path.exists(after))
+
+    def test_runs_in_calling_worker(self):
+        """test that no nested worker is started for a script"""
+        self.write_script("import threading\nprint(threading.current_thread().is_top_level())\n", "toplevel.py")
+        self.write_script(os.path.join(self.tmpdir, "toplevel.py") + "\n")
+        self.assertEqual(self.run_command(self.script, exitcode=0), "True\n")
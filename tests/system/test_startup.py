@@ -0,0 +1,44 @@
+# coding=utf-8
+"""Tests for the startup of StaSh"""
+from stash import stash
+from stash.system.shparsers import ShParser
+from stash.tests.stashtest import StashTestCase
+
+
+class StartupTests(StashTestCase):
+    """Tests for the startup profiling and the lazy initialization"""
+
+    def test_startup_profile(self):
+        """test that the time to first prompt is recorded per phase"""
+        s = stash.StaSh(no_historyfile=True)
+        for phase in ("config", "ui", "runtime", "rcfile", "lib", "command"):
+            self.assertIn(phase, s.startup_times)
+            self.assertGreaterEqual(s.startup_times[phase], 0.0)
+        report = s.get_startup_report()
+        self.assertIn("total", report)
+        self.logger.info(report)
+        # the prompt is shown at the end of the startup
+        self.assertTrue(s.main_screen.text.endswith("$ "))
+
+    def test_lazy_lib(self):
+        """test that libraries are loaded on first access"""
+        s = stash.StaSh(no_historyfile=True, command=False)
+        self.assertNotIn("libcore", s.__dict__)
+        self.assertTrue(hasattr(s.libcore, "sizeof_fmt"))
+        self.assertIn("libcore", s.__dict__)
+        self.assertFalse(hasattr(s, "libdoesnotexist"))
+
+    def test_lazy_grammar(self):
+        """test that the pyparsing grammar is built on first parse"""
+        parser = ShParser(engine="pyparsing")
+        self.assertIsNone(parser.parser)
+        tokens, _ = parser.parse("ls -l")
+        self.assertIsNotNone(parser.parser)
+        self.assertEqual([t.tok for t in tokens], ["ls", "-l"])
+
+    def test_history_loaded_on_first_use(self):
+        """test that the history is usable right after the startup"""
+        history = self.stash.runtime.history
+        history.swap("StartupTest")
+        history.add("test")
+        self.assertIn("test", history.getlist())
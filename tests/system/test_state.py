@@ -0,0 +1,89 @@
+# coding=utf-8
+"""Tests for stash.system.shthreads.ShState and its copy-on-write mappings"""
+import unittest
+
+from stash.system.shthreads import ShAliases, ShLayeredDict, ShState
+from stash.tests.stashtest import StashTestCase
+
+
+class LayeredDictTests(unittest.TestCase):
+    """Tests for ShLayeredDict"""
+
+    def test_mapping(self):
+        """test the basic mapping interface"""
+        d = ShLayeredDict({"A": "1"})
+        d["B"] = "2"
+        self.assertEqual(d["A"], "1")
+        self.assertEqual(d.get("B"), "2")
+        self.assertIsNone(d.get("C"))
+        self.assertIn("A", d)
+        self.assertNotIn("C", d)
+        self.assertEqual(len(d), 2)
+        self.assertEqual(sorted(d), ["A", "B"])
+        self.assertEqual(dict(d), {"A": "1", "B": "2"})
+        self.assertEqual(d, {"A": "1", "B": "2"})
+        del d["A"]
+        self.assertNotIn("A", d)
+        self.assertRaises(KeyError, d.__delitem__, "A")
+        self.assertRaises(KeyError, d.__getitem__, "A")
+
+    def test_copy_on_write(self):
+        """test that a copy and the original do not affect each other"""
+        parent = ShLayeredDict({"A": "1", "B": "2"})
+        child = ShLayeredDict(parent)
+        child["A"] = "changed"
+        del child["B"]
+        child["C"] = "3"
+        parent["D"] = "4"
+        self.assertEqual(dict(parent), {"A": "1", "B": "2", "D": "4"})
+        self.assertEqual(dict(child), {"A": "changed", "C": "3"})
+        grandchild = child.copy()
+        grandchild["B"] = "again"
+        self.assertEqual(dict(grandchild), {"A": "changed", "B": "again", "C": "3"})
+        self.assertNotIn("B", child)
+
+    def test_flatten(self):
+        """test that the chain of layers is bounded"""
+        d = ShLayeredDict({"A": "0"})
+        for i in range(ShLayeredDict.MAX_LAYERS * 3):
+            d["A"] = str(i)
+            d["X%d" % i] = "x"
+            del d["X%d" % i]
+            d = ShLayeredDict(d)
+        self.assertLessEqual(len(d._layers), ShLayeredDict.MAX_LAYERS)
+        self.assertEqual(dict(d), {"A": str(ShLayeredDict.MAX_LAYERS * 3 - 1)})
+
+    def test_alias_versions(self):
+        """test that a copy shares the version until it is modified"""
+        aliases = ShAliases({"ll": ("ls -l", "ls -l")})
+        copy = ShAliases(aliases)
+        self.assertEqual(copy.version, aliases.version)
+        copy["la"] = ("ls -a", "ls -a")
+        self.assertNotEqual(copy.version, aliases.version)
+        self.assertNotIn("la", aliases)
+
+
+class StateTests(StashTestCase):
+    """Tests for the state of workers"""
+
+    def test_new_from_parent(self):
+        """test that a child state is independent of its parent"""
+        parent = ShState(environ={"A": "1"}, aliases={"x": ("y", "y")})
+        parent.temporary_environ = {"T": "2"}
+        child = ShState.new_from_parent(parent)
+        self.assertEqual(child.environ["T"], "2")
+        child.environ["A"] = "changed"
+        child.aliases["z"] = ("w", "w")
+        self.assertEqual(parent.environ["A"], "1")
+        self.assertNotIn("T", parent.environ)
+        self.assertNotIn("z", parent.aliases)
+
+    def test_persistent_levels(self):
+        """test that variables persist according to the persistent level"""
+        self.stash("PLTEST=0", persistent_level=0)
+        self.assertNotIn("PLTEST", self.stash.runtime.state.environ)
+        self.stash("PLTEST=1", persistent_level=1)
+        self.assertEqual(self.stash.runtime.state.environ["PLTEST"], "1")
+        self.stash("PLTEST=2", persistent_level=2)
+        self.assertEqual(self.stash.runtime.state.environ["PLTEST"], "1")
+        self.assertEqual(self.run_command("echo $PLTEST", exitcode=0), "2\n")
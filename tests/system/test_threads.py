@@ -3,6 +3,7 @@ import time
 
 from six import StringIO
 
+from stash.system.shthreads import ShCooperativeThread, cancellable_sleep
 from stash.tests.stashtest import StashTestCase
 
 
@@ -68,3 +69,53 @@ test_102_1.py
 test_102_1.py
 """
         assert outs1.getvalue() == cmp_str2, 'output not identical'
+
+
+class CooperativeThreadsTests(StashTestCase):
+    """
+    Tests for the cancellation of cooperative threads
+    """
+
+    setup_commands = ['BIN_PATH=$STASH_ROOT/tests/system/data:$BIN_PATH']
+
+    def setUp(self):
+        StashTestCase.setUp(self)
+        self.stash.runtime.ShThread = ShCooperativeThread
+        self.saved_sleep = time.sleep
+        time.sleep = cancellable_sleep
+
+    def tearDown(self):
+        time.sleep = self.saved_sleep
+        StashTestCase.tearDown(self)
+
+    def kill_after(self, cmd, delay=0.3):
+        """
+        Run a command, kill it after a delay and return the time it took to end.
+        """
+        worker = self.stash.runtime.run(cmd, final_outs=StringIO(), final_errs=StringIO())
+        self.saved_sleep(delay)
+        self.assertTrue(worker.is_alive())
+        start = time.time()
+        worker.kill()
+        worker.join(10)
+        self.assertFalse(worker.is_alive())
+        return time.time() - start
+
+    def test_check_point(self):
+        """
+        A thread ends at the next check point
+        """
+        self.assertLess(self.kill_after('test_cancel_loop.py write'), ShCooperativeThread.escalation_delay)
+
+    def test_sleep(self):
+        """
+        A thread ends while it sleeps
+        """
+        self.assertLess(self.kill_after('test_cancel_loop.py sleep'), ShCooperativeThread.escalation_delay)
+
+    def test_escalation(self):
+        """
+        A thread without check points is killed after the escalation delay
+        """
+        self.assertGreaterEqual(self.kill_after('test_cancel_loop.py loop'), ShCooperativeThread.escalation_delay * 0.9)
+
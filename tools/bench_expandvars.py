@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the expansion of variables.
+
+Expands a corpus of words containing variables and parameter expansions and
+prints the time per word. Run it from within StaSh.
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+_stash = globals()["_stash"]
+
+CORPUS = [
+    'plain_word_without_variables',
+    '$HOME',
+    '${HOME}/Documents/$BENCH_FILE',
+    'prefix_${BENCH_FILE%.*}_suffix',
+    '${UNSET_VARIABLE:-$BENCH_FILE} $? $# $1',
+    'a $BENCH_A b $BENCH_B c ${#BENCH_FILE} d ${BENCH_FILE##*.}',
+]
+
+
+def main():
+    """
+    The main function.
+    """
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-n", "--repeat", type=int, default=20000, help="how often the corpus is expanded")
+    ns = ap.parse_args()
+
+    environ = _stash.runtime.state.environ
+    environ.update(BENCH_FILE="archive.tar.gz", BENCH_A="1", BENCH_B="2")
+    expandvars = _stash.runtime.expander.expandvars
+    try:
+        for word in CORPUS:
+            t = timeit.timeit(lambda: expandvars(word), number=ns.repeat) / ns.repeat
+            print("{:10.2f} us  {}".format(t * 1e6, word))
+    finally:
+        for name in ("BENCH_FILE", "BENCH_A", "BENCH_B"):
+            environ.pop(name, None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the parser engines.
+
+Parses a corpus of command lines with the native and the pyparsing engine
+(without the parse cache) and prints the time per line of each engine.
+Requires the stash package to be importable.
+"""
+from __future__ import print_function
+
+import argparse
+import timeit
+
+from stash.system.shparsers import ShParser
+
+CORPUS = [
+    'ls',
+    'ls -la ~/Documents  # list the documents',
+    'echo "hello $USER" | grep -i hello > out.txt',
+    'A=1 B="2 3" python script.py --flag value; echo $?',
+    'cat a.txt b.txt | sort | uniq -c | sort -n >> counts.txt &',
+    "find . -name '*.py' | xargs grep -n \"import os\"",
+    'echo \\x41\\101 `pwd`/file\\ name',
+    'git commit -m "fix \\"quoted\\" message"; git push origin master',
+]
+
+
+def bench(engine, repeat):
+    """
+    Return the mean time in seconds to parse one line of the corpus.
+    :param engine: the parser engine to use
+    :type engine: str
+    :param repeat: how often the corpus is parsed
+    :type repeat: int
+    :return: the mean time per line
+    :rtype: float
+    """
+    parser = ShParser(cache_size=0, engine=engine)
+
+    def parse_all():
+        for line in CORPUS:
+            parser.parse(line)
+
+    parse_all()  # builds the grammar of the pyparsing engine
+    t = timeit.timeit(parse_all, number=repeat)
+    return t / (repeat * len(CORPUS))
+
+
+def main():
+    """
+    The main function.
+    """
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument('-n', '--repeat', type=int, default=200, help='how often the corpus is parsed')
+    ns = ap.parse_args()
+
+    results = {}
+    for engine in ('pyparsing', 'native'):
+        results[engine] = bench(engine, ns.repeat)
+        print('{:<10s} {:10.1f} us/line'.format(engine, results[engine] * 1e6))
+    print('speedup    {:10.1f}x'.format(results['pyparsing'] / results['native']))
+
+
+if __name__ == '__main__':
+    main()
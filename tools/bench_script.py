@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the execution of shell scripts.
+
+Runs a generated script of 1,000 lines with a cold script cache (the script
+is compiled on every run) and with a warm one and prints the time per run.
+Run it from within StaSh.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import timeit
+
+_stash = globals()["_stash"]
+
+
+def write_script(path, n_lines):
+    """
+    Write a script consisting of assignments, aliases and comments.
+    :param path: path to write to
+    :type path: str
+    :param n_lines: number of lines
+    :type n_lines: int
+    """
+    with open(path, "w") as fout:
+        for i in range(n_lines):
+            if i % 10 == 0:
+                fout.write("# comment {}\n".format(i))
+            elif i % 10 == 1:
+                fout.write("alias a{}='echo {}'\n".format(i, i))
+            else:
+                fout.write('VAR_{0}="value $VAR_{1} {0}" OTHER=$HOME/{0}\n'.format(i, i - 1))
+
+
+def main():
+    """
+    The main function.
+    """
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-l", "--lines", type=int, default=1000, help="number of lines of the script")
+    ap.add_argument("-n", "--repeat", type=int, default=5, help="how often the script is run")
+    ns = ap.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "bench.sh")
+        write_script(path, ns.lines)
+        runtime = _stash.runtime
+
+        def run_cold():
+            runtime.script_cache.clear()
+            _stash(path, persistent_level=0)
+
+        def run_warm():
+            _stash(path, persistent_level=0)
+
+        for name, fn in (("cold", run_cold), ("warm", run_warm)):
+            fn()
+            t = timeit.timeit(fn, number=ns.repeat) / ns.repeat
+            print("{:<6s} {:10.1f} ms/run".format(name, t * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark writing to sys.stdout from a worker.
+
+Calls sys.stdout.write() 1,000,000 times with the output going to a stream
+which discards it and prints the time per call. For comparison, the same is
+done with a wrapper which looks up the thread and its state and wraps write()
+for the stats of the worker on every access, like the wrappers did before.
+Run it from within StaSh.
+"""
+from __future__ import print_function
+
+import argparse
+import sys
+import threading
+import timeit
+
+from stash.system.shiowrapper import _counted_write
+from stash.system.shthreads import ShBaseThread
+
+_stash = globals()["_stash"]
+
+
+class NullWriter(object):
+    """
+    A stream which discards everything written to it.
+    """
+
+    def write(self, s):
+        pass
+
+    def flush(self):
+        pass
+
+
+class LookupStdoutWrapper(object):
+    """
+    Dispatch by looking up the current thread on every attribute access.
+    """
+
+    def __getattribute__(self, item):
+        thread = threading.current_thread()
+        if isinstance(thread, ShBaseThread):
+            attr = getattr(thread.state.sys_stdout, item)
+            if item == "write":
+                return _counted_write(item, attr, thread.stats, "stdout_size")
+            return attr
+        else:
+            return getattr(sys.__stdout__, item)
+
+
+def main():
+    """
+    The main function.
+    """
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("-n", "--number", type=int, default=1000000, help="number of calls to write()")
+    ap.add_argument("-r", "--repeat", type=int, default=3, help="number of runs, the fastest counts")
+    ns = ap.parse_args()
+
+    _, state = _stash.runtime.get_current_worker_and_state()
+    saved_stdout = state.sys_stdout
+    lookup_wrapper = LookupStdoutWrapper()
+    results = {}
+    try:
+        state.sys_stdout = NullWriter()
+        results["lookup"] = min(timeit.repeat(lambda: lookup_wrapper.write("x"), number=ns.number, repeat=ns.repeat))
+        results["cached"] = min(timeit.repeat(lambda: sys.stdout.write("x"), number=ns.number, repeat=ns.repeat))
+    finally:
+        state.sys_stdout = saved_stdout
+
+    for name in ("lookup", "cached"):
+        print("{:<8s} {:8.3f} s  {:8.1f} ns/call".format(name, results[name], results[name] / ns.number * 1e9))
+    print("speedup  {:8.1f}x".format(results["lookup"] / results["cached"]))
+
+
+if __name__ == "__main__":
+    main()